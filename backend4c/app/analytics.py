@@ -0,0 +1,258 @@
+"""
+Issue analytics rollups.
+
+Issue counts per product per hour and per day, and per user and product,
+are kept in small rollup tables so dashboard reports never scan the
+issues table. A background compactor folds new issues into the rollups:
+it remembers the last issue id it processed (analytics_state) and on every
+pass aggregates only the issues above it, a bounded id range per
+transaction. Every write path (single, bulk, group-commit, offline bulk
+classification) is covered without adding work to the request path.
+
+Counts are by the product predicted when the issue was logged.
+
+Usage:
+    python -m app.analytics compact      # fold in new issues now
+    python -m app.analytics rebuild      # recompute every rollup from scratch
+    python -m app.analytics status
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from . import models
+from .database import SessionLocal, engine
+from .migrations import run_migrations
+from .utils import metrics
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+ANALYTICS_LAG = metrics.gauge('analytics_lag_issues', 'Issues not yet folded into the analytics rollups')
+COMPACTION_SECONDS = metrics.histogram('analytics_compaction_seconds', 'Time per analytics compaction pass')
+
+# Seconds between compaction passes; 0 only compacts on demand
+COMPACT_INTERVAL_SECONDS = float(os.getenv('ANALYTICS_COMPACT_INTERVAL_SECONDS', '10'))
+# Issue ids folded in per transaction, so a large backlog never holds the write lock for long
+COMPACT_CHUNK_SIZE = int(os.getenv('ANALYTICS_COMPACT_CHUNK_SIZE', '50000'))
+
+WATERMARK = 'last_issue_id'
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+DAY_FORMAT = '%Y-%m-%d'
+
+# Claim the id range first: the UPDATE takes the write lock, and if another
+# process's compactor already moved the watermark it matches no row
+_CLAIM = text("UPDATE analytics_state SET value = :hi WHERE name = :name AND value = :lo")
+_FOLD = [
+    text(f"""
+        INSERT INTO analytics_product_hourly (hour, product_code, product_name, count)
+        SELECT strftime('{HOUR_FORMAT}', created_at), product_code, max(product_name), count(*)
+        FROM issues WHERE id > :lo AND id <= :hi
+        GROUP BY 1, 2
+        ON CONFLICT (hour, product_code) DO UPDATE SET
+            count = count + excluded.count, product_name = excluded.product_name
+    """),
+    text(f"""
+        INSERT INTO analytics_product_daily (day, product_code, product_name, count)
+        SELECT strftime('{DAY_FORMAT}', created_at), product_code, max(product_name), count(*)
+        FROM issues WHERE id > :lo AND id <= :hi
+        GROUP BY 1, 2
+        ON CONFLICT (day, product_code) DO UPDATE SET
+            count = count + excluded.count, product_name = excluded.product_name
+    """),
+    text("""
+        INSERT INTO analytics_user_product (user_id, product_code, product_name, count, last_issue_at)
+        SELECT user_id, product_code, max(product_name), count(*), max(created_at)
+        FROM issues WHERE id > :lo AND id <= :hi AND user_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, product_code) DO UPDATE SET
+            count = count + excluded.count,
+            product_name = excluded.product_name,
+            last_issue_at = max(coalesce(last_issue_at, ''), excluded.last_issue_at)
+    """),
+]
+
+
+def _positions(conn):
+    conn.execute(
+        text("INSERT OR IGNORE INTO analytics_state (name, value) VALUES (:name, 0)"), {"name": WATERMARK}
+    )
+    last = conn.execute(
+        text("SELECT value FROM analytics_state WHERE name = :name"), {"name": WATERMARK}
+    ).scalar()
+    max_id = conn.execute(text("SELECT coalesce(max(id), 0) FROM issues")).scalar()
+    return last, max_id
+
+
+def compact(target_engine=engine, chunk_size=COMPACT_CHUNK_SIZE):
+    """Fold issues above the watermark into the rollups; returns the number of ids advanced"""
+    chunk_size = max(1, int(chunk_size))
+    advanced = 0
+    with COMPACTION_SECONDS.time():
+        while True:
+            with target_engine.begin() as conn:
+                last, max_id = _positions(conn)
+            ANALYTICS_LAG.set(max_id - last)
+            if max_id <= last:
+                return advanced
+            hi = min(max_id, last + chunk_size)
+            with target_engine.begin() as conn:
+                claimed = conn.execute(_CLAIM, {"name": WATERMARK, "lo": last, "hi": hi}).rowcount
+                if not claimed:
+                    # Another process folded this range in; re-read the watermark
+                    continue
+                for statement in _FOLD:
+                    conn.execute(statement, {"lo": last, "hi": hi})
+            advanced += hi - last
+            logger.debug(f"Folded issues {last + 1}..{hi} into the analytics rollups")
+
+
+def rebuild(target_engine=engine):
+    """Drop every rollup and recompute them from the issues table"""
+    with target_engine.begin() as conn:
+        for table in ('analytics_product_hourly', 'analytics_product_daily', 'analytics_user_product'):
+            conn.execute(text(f"DELETE FROM {table}"))
+        conn.execute(text("DELETE FROM analytics_state WHERE name = :name"), {"name": WATERMARK})
+    logger.info("Analytics rollups cleared; recomputing")
+    return compact(target_engine)
+
+
+def status(db: Session):
+    last = db.query(models.AnalyticsState.value).filter(models.AnalyticsState.name == WATERMARK).scalar() or 0
+    max_id = db.query(func.coalesce(func.max(models.Issue.id), 0)).scalar()
+    return {"last_issue_id": last, "max_issue_id": max_id, "lag": max(0, max_id - last)}
+
+
+def product_counts(db: Session, granularity, since, until=None, product_code=None):
+    """
+    Per-bucket and total issue counts per product for since <= bucket < until.
+    granularity is 'hour' or 'day'; since / until are datetimes.
+    """
+    if granularity == 'hour':
+        model, bucket, fmt = models.ProductHourlyCount, models.ProductHourlyCount.hour, HOUR_FORMAT
+    elif granularity == 'day':
+        model, bucket, fmt = models.ProductDailyCount, models.ProductDailyCount.day, DAY_FORMAT
+    else:
+        raise ValueError(f"Unknown granularity: {granularity} (expected hour or day)")
+
+    query = db.query(bucket, model.product_code, model.product_name, model.count).filter(
+        bucket >= since.strftime(fmt)
+    )
+    if until is not None:
+        query = query.filter(bucket < until.strftime(fmt))
+    if product_code is not None:
+        query = query.filter(model.product_code == product_code)
+    rows = query.order_by(bucket, model.product_code).all()
+
+    totals = {}
+    for _, code, name, count in rows:
+        total = totals.setdefault(code, {"product_code": code, "product_name": name, "count": 0})
+        total["count"] += count
+    return {
+        "buckets": [
+            {"bucket": row[0], "product_code": row[1], "product_name": row[2], "count": row[3]}
+            for row in rows
+        ],
+        "totals": sorted(totals.values(), key=lambda total: total["count"], reverse=True),
+    }
+
+
+def top_users(db: Session, limit=50, product_code=None):
+    """Users with the most issues (optionally for one product), most first"""
+    rollup = models.UserProductCount
+    total = func.sum(rollup.count).label('total')
+    query = (
+        db.query(rollup.user_id, models.User.email, total, func.max(rollup.last_issue_at))
+        .outerjoin(models.User, models.User.id == rollup.user_id)
+    )
+    if product_code is not None:
+        query = query.filter(rollup.product_code == product_code)
+    rows = query.group_by(rollup.user_id, models.User.email).order_by(total.desc()).limit(limit).all()
+    return [
+        {"user_id": user_id, "email": email, "count": count, "last_issue_at": last_issue_at}
+        for user_id, email, count, last_issue_at in rows
+    ]
+
+
+def user_product_counts(db: Session, user_id):
+    """One user's issue counts per product, most first"""
+    rollup = models.UserProductCount
+    rows = (
+        db.query(rollup.product_code, rollup.product_name, rollup.count, rollup.last_issue_at)
+        .filter(rollup.user_id == user_id)
+        .order_by(rollup.count.desc())
+        .all()
+    )
+    return [
+        {"product_code": code, "product_name": name, "count": count, "last_issue_at": last_issue_at}
+        for code, name, count, last_issue_at in rows
+    ]
+
+
+class AnalyticsCompactor:
+    """Runs compact() on a background thread, now and every interval"""
+
+    def __init__(self, interval_seconds=COMPACT_INTERVAL_SECONDS):
+        self.interval = max(0.0, float(interval_seconds))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="analytics-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def compact_now(self):
+        """Compact on the calling thread; waits for a pass that is already running"""
+        with self._lock:
+            try:
+                return compact()
+            except Exception as e:
+                logger.error(f"Error compacting analytics rollups: {e}", exc_info=True)
+                return None
+
+    def _run(self):
+        self.compact_now()
+        while self.interval and not self._stop.wait(self.interval):
+            self.compact_now()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the issue analytics rollups")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('compact', help="fold issues logged since the last pass into the rollups")
+    subparsers.add_parser('rebuild', help="recompute every rollup from the issues table")
+    subparsers.add_parser('status', help="show the compactor watermark and lag")
+    args = parser.parse_args(argv)
+
+    run_migrations()
+    start = time.perf_counter()
+    if args.command == 'compact':
+        logger.info(f"Folded in {compact()} issue ids in {time.perf_counter() - start:.2f}s")
+    elif args.command == 'rebuild':
+        logger.info(f"Rebuilt rollups over {rebuild()} issue ids in {time.perf_counter() - start:.2f}s")
+    elif args.command == 'status':
+        db = SessionLocal()
+        try:
+            print(json.dumps(status(db)))
+        finally:
+            db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Async counterparts of the functions in crud.py, for use with
+AsyncSession from database.get_async_session in async route handlers.
+"""
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models
+from .crud import DB_WRITE_SECONDS, ISSUE_LIST_COLUMNS, decode_issue_cursor, encode_issue_cursor
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).where(models.User.id == user_id))
+    return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
+    if not user:
+        return None
+    if user.password != password:  # Simple password comparison
+        return None
+    return user
+
+async def create_user(db: AsyncSession, email: str, password: str, is_active: bool = True, is_superuser: bool = False):
+    db_user = models.User(
+        email=email,
+        password=password,  # Store plain password
+        is_active=is_active,
+        is_superuser=is_superuser
+    )
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def get_user_issues(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.Issue).where(models.Issue.user_id == user_id))
+    return result.scalars().all()
+
+async def get_user_issues_page(db: AsyncSession, user_id: int, limit: int = 50, cursor: str = None):
+    """Async crud.get_user_issues_page; returns (issues, next_cursor)"""
+    stmt = select(*ISSUE_LIST_COLUMNS).where(models.Issue.user_id == user_id)
+    if cursor:
+        created_at, issue_id = decode_issue_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(models.Issue.created_at, models.Issue.id) < tuple_(created_at, issue_id)
+        )
+    stmt = stmt.order_by(models.Issue.created_at.desc(), models.Issue.id.desc()).limit(limit + 1)
+    issues = (await db.execute(stmt)).all()
+    next_cursor = None
+    if len(issues) > limit:
+        issues = issues[:limit]
+        next_cursor = encode_issue_cursor(issues[-1])
+    return issues, next_cursor
+
+async def create_user_issue(
+    db: AsyncSession, 
+    issue: models.IssueCreate, 
+    user_id: int,
+    product_code: int,
+    product_name: str,
+    response: str
+):
+    # Get current time in local timezone
+    current_time = models.Issue.get_current_time()
+    logger.debug(f"Creating issue at local time: {current_time}")
+
+    db_issue = models.Issue(
+        query=issue.query,
+        user_id=user_id,
+        product_code=product_code,
+        product_name=product_name,
+        response=response,
+        created_at=current_time
+    )
+    db.add(db_issue)
+    with DB_WRITE_SECONDS.time(operation="insert"):
+        await db.flush()
+    with DB_WRITE_SECONDS.time(operation="commit"):
+        await db.commit()
+    return db_issue
+
+async def create_issues(db: AsyncSession, issues: list):
+    """Insert many issues in a single transaction and return their ids"""
+    current_time = models.Issue.get_current_time()
+    db_issues = [
+        models.Issue(**{"created_at": current_time, **item})
+        for item in issues
+    ]
+    db.add_all(db_issues)
+    with DB_WRITE_SECONDS.time(operation="insert"):
+        await db.flush()  # assigns primary keys
+    issue_ids = [db_issue.id for db_issue in db_issues]
+    with DB_WRITE_SECONDS.time(operation="commit"):
+        await db.commit()
+    return issue_ids
+
+async def create_user_issues(db: AsyncSession, user_id: int, issues: list):
+    """Insert many classified issues for one user in a single transaction"""
+    issue_ids = await create_issues(db, [{**item, "user_id": user_id} for item in issues])
+    logger.debug(f"Created {len(issue_ids)} issues for user {user_id} in one transaction")
+    return issue_ids
+
+async def get_issue(db: AsyncSession, issue_id: int):
+    result = await db.execute(select(models.Issue).where(models.Issue.id == issue_id))
+    return result.scalars().first()
+
+async def correct_issue(db: AsyncSession, issue: models.Issue, product_code: int):
+    """Record the right product for a misclassified issue"""
+    issue.corrected_product_code = product_code
+    issue.corrected_at = models.Issue.get_current_time()
+    await db.commit()
+    return issue
@@ -0,0 +1,184 @@
+"""
+Session-to-user resolution backed by an in-process user cache.
+
+Logins and authenticated requests look users up here instead of querying
+the users table every time. The cache is keyed by id and by email and
+holds CachedUser snapshots rather than ORM objects, so entries can be
+shared across sessions and threads. Every ORM insert, update or delete of a
+User drops its entries (mapper events below), and entries expire after
+USER_CACHE_TTL_SECONDS so writes made by other processes, or by bulk
+UPDATE statements that bypass the ORM, are picked up as well.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import async_crud, models
+from .database import get_async_session
+from .utils import metrics
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+USER_CACHE_LOOKUPS = metrics.counter('user_cache_lookups_total', 'User cache lookups', ['key', 'result'])
+
+# User cache knobs; USER_CACHE_SIZE=0 disables caching
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '300'))
+
+
+class CachedUser(NamedTuple):
+    """Immutable copy of a users row"""
+    id: int
+    email: str
+    password: str
+    full_name: Optional[str]
+    is_active: bool
+    is_superuser: bool
+
+    @classmethod
+    def from_orm(cls, user):
+        return cls(
+            user.id, user.email, user.password, user.full_name,
+            bool(user.is_active if user.is_active is not None else True), bool(user.is_superuser),
+        )
+
+    def __repr__(self):
+        # Keep the password out of logs
+        return f"CachedUser(id={self.id}, email={self.email!r}, is_superuser={self.is_superuser})"
+
+
+class UserCache:
+    """Bounded LRU of CachedUser by id, with an email -> id index"""
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl_seconds=USER_CACHE_TTL_SECONDS):
+        self.enabled = max_size > 0
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl_seconds)
+        self._by_id = OrderedDict()
+        self._id_by_email = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, user_id):
+        entry = self._by_id.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            self._remove(user_id)
+            return None
+        self._by_id.move_to_end(user_id)
+        return user
+
+    def _remove(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None:
+            self._id_by_email.pop(entry[1].email, None)
+
+    def get(self, user_id):
+        with self._lock:
+            user = self._lookup(user_id)
+        USER_CACHE_LOOKUPS.inc(key='id', result='hit' if user else 'miss')
+        return user
+
+    def get_by_email(self, email):
+        with self._lock:
+            user_id = self._id_by_email.get(email)
+            user = self._lookup(user_id) if user_id is not None else None
+        USER_CACHE_LOOKUPS.inc(key='email', result='hit' if user else 'miss')
+        return user
+
+    def put(self, user):
+        """Cache an ORM User (or CachedUser) and return its CachedUser"""
+        cached = user if isinstance(user, CachedUser) else CachedUser.from_orm(user)
+        if not self.enabled:
+            return cached
+        with self._lock:
+            self._remove(cached.id)
+            self._by_id[cached.id] = (time.monotonic() + self.ttl, cached)
+            self._id_by_email[cached.email] = cached.id
+            while len(self._by_id) > self.max_size:
+                self._remove(next(iter(self._by_id)))
+        return cached
+
+    def invalidate(self, user_id=None, email=None):
+        with self._lock:
+            if user_id is not None:
+                self._remove(user_id)
+            if email is not None:
+                other_id = self._id_by_email.get(email)
+                if other_id is not None:
+                    self._remove(other_id)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._id_by_email.clear()
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+USER_CACHE = UserCache()
+
+
+@event.listens_for(models.User, 'after_insert')
+@event.listens_for(models.User, 'after_update')
+@event.listens_for(models.User, 'after_delete')
+def _invalidate_user(mapper, connection, target):
+    # Runs at flush time on whichever session wrote the user
+    USER_CACHE.invalidate(user_id=target.id, email=target.email)
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    """CachedUser for user_id, querying the DB only on a cache miss"""
+    user = USER_CACHE.get(user_id)
+    if user is None:
+        db_user = await async_crud.get_user(db, user_id)
+        if db_user is None:
+            return None
+        user = USER_CACHE.put(db_user)
+    return user
+
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    """CachedUser if email and password match, else None"""
+    user = USER_CACHE.get_by_email(email)
+    if user is None:
+        db_user = await async_crud.get_user_by_email(db, email)
+        if db_user is None:
+            return None
+        user = USER_CACHE.put(db_user)
+    if user.password != password:  # Simple password comparison
+        return None
+    return user
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_async_session)):
+    """
+    The logged-in user for this request. The signed session cookie carries
+    the user id, and the user itself normally comes from the cache, so
+    this costs no DB query once the user has been seen.
+    """
+    user_id = request.session.get("user_id")
+    if not user_id:
+        logger.warning(f"Unauthorized access attempt - no user_id in session ({request.url.path})")
+        raise HTTPException(status_code=401, detail="Please log in to use the chatbot")
+    user = await get_user(db, user_id)
+    if user is None or not user.is_active:
+        logger.warning(f"Session for unknown or inactive user {user_id} rejected")
+        request.session.clear()
+        raise HTTPException(status_code=401, detail="Please log in to use the chatbot")
+    return user
+
+
+async def require_superuser(request: Request, user: CachedUser = Depends(get_current_user)):
+    """Allow only logged-in superusers"""
+    if not user.is_superuser:
+        logger.warning(f"Non-admin user {user.id} denied access to {request.url.path}")
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
@@ -0,0 +1,185 @@
+"""
+Online database backups.
+
+Snapshots are taken with SQLite's online backup API in a single step. A
+stepped copy starts over whenever another connection writes between steps,
+so on a busy database it may never finish; copying everything at once only
+holds a read snapshot, which under the WAL journal (DB_PROFILE=wal) does
+not block writers. Each snapshot is gzip-compressed and only the newest
+DB_BACKUP_KEEP are kept.
+
+Usage:
+    python -m app.backup create
+    python -m app.backup list
+    python -m app.backup restore data4c/backups/db4chatbot_20241209_101500_000000.db.gz
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from .database import DB_DIRECTORY, DB_PATH
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+BACKUP_DIRECTORY = os.getenv('DB_BACKUP_DIRECTORY', os.path.join(DB_DIRECTORY, 'backups'))
+# Minutes between scheduled backups; 0 only backs up at startup and shutdown
+BACKUP_INTERVAL_MINUTES = float(os.getenv('DB_BACKUP_INTERVAL_MINUTES', '0'))
+BACKUP_KEEP = int(os.getenv('DB_BACKUP_KEEP', '5'))
+
+BACKUP_PREFIX = 'db4chatbot_'
+BACKUP_SUFFIX = '.db.gz'
+
+
+def list_backups(backup_dir=BACKUP_DIRECTORY):
+    """Compressed snapshots in backup_dir, oldest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(
+        os.path.join(backup_dir, name)
+        for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)
+    )
+
+
+def _prune(backup_dir, keep):
+    backups = list_backups(backup_dir)
+    for old_backup in backups[:-keep] if keep > 0 else []:
+        os.remove(old_backup)
+        logger.debug(f"Removed old backup: {old_backup}")
+
+
+def create_backup(db_path=DB_PATH, backup_dir=BACKUP_DIRECTORY, keep=BACKUP_KEEP):
+    """Write a compressed online snapshot of db_path and return its path"""
+    if not os.path.exists(db_path):
+        logger.warning("No database to backup")
+        return None
+
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    backup_path = os.path.join(backup_dir, f'{BACKUP_PREFIX}{timestamp}{BACKUP_SUFFIX}')
+    snapshot_path = os.path.join(backup_dir, f'.{BACKUP_PREFIX}{timestamp}.db.partial')
+
+    start = time.perf_counter()
+    try:
+        source = sqlite3.connect(db_path)
+        target = sqlite3.connect(snapshot_path)
+        try:
+            # All pages in one step, from one consistent read snapshot
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+        with open(snapshot_path, 'rb') as raw, gzip.open(f"{backup_path}.partial", 'wb') as compressed:
+            shutil.copyfileobj(raw, compressed, length=1024 * 1024)
+        os.replace(f"{backup_path}.partial", backup_path)
+    finally:
+        for leftover in (snapshot_path, f"{backup_path}.partial"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    logger.info(f"Database backed up to {backup_path} in {time.perf_counter() - start:.2f}s")
+    _prune(backup_dir, keep)
+    return backup_path
+
+
+def restore_backup(backup_path, db_path=DB_PATH):
+    """
+    Replace db_path with the contents of a compressed snapshot. Run it with
+    the API stopped; the snapshot is integrity-checked before anything is
+    overwritten.
+    """
+    snapshot_path = f"{db_path}.restore"
+    try:
+        with gzip.open(backup_path, 'rb') as compressed, open(snapshot_path, 'wb') as raw:
+            shutil.copyfileobj(compressed, raw, length=1024 * 1024)
+
+        source = sqlite3.connect(snapshot_path)
+        try:
+            result = source.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != 'ok':
+                raise ValueError(f"Backup {backup_path} failed integrity check: {result}")
+            # Copy through the backup API so an existing WAL is handled correctly
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    finally:
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+    logger.info(f"Database restored from {backup_path}")
+
+
+class BackupScheduler:
+    """Runs create_backup on a background thread, now and every interval"""
+
+    def __init__(self, interval_minutes=BACKUP_INTERVAL_MINUTES):
+        self.interval = max(0.0, float(interval_minutes)) * 60
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def backup_now(self):
+        """Take a backup on the calling thread, skipping it if one is already running"""
+        if not self._lock.acquire(blocking=False):
+            logger.info("Backup already in progress; skipping")
+            return None
+        try:
+            return create_backup()
+        except Exception as e:
+            logger.error(f"Error backing up database: {e}", exc_info=True)
+            return None
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        self.backup_now()
+        while self.interval and not self._stop.wait(self.interval):
+            self.backup_now()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backup and restore of the chatbot database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('create', help="write a compressed snapshot now")
+    subparsers.add_parser('list', help="list snapshots, oldest first")
+    restore = subparsers.add_parser('restore', help="restore a snapshot (stop the API first)")
+    restore.add_argument('backup', help="path to a .db.gz snapshot")
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        create_backup()
+    elif args.command == 'list':
+        for backup in list_backups():
+            print(backup)
+    elif args.command == 'restore':
+        restore_backup(args.backup)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
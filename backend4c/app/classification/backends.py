@@ -0,0 +1,250 @@
+import inspect
+import os
+import torch
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Which inference backend IssueClassifier uses: eager | int8 | onnx
+CLASSIFIER_BACKEND = os.getenv('CLASSIFIER_BACKEND', 'eager')
+# Also export ONNX when publishing a version under another backend, so the
+# version can later be served with CLASSIFIER_BACKEND=onnx
+EXPORT_ONNX = os.getenv('MODEL_EXPORT_ONNX', 'false').lower() in ('1', 'true', 'yes')
+# Graph compilation of the eager / int8 model: off | torchscript | compile
+CLASSIFIER_COMPILE = os.getenv('CLASSIFIER_COMPILE', 'off').lower()
+# Torch intra-op / inter-op CPU threads for in-process inference (the intra-op
+# count also sizes ONNX Runtime's pool); 0 keeps the library defaults
+TORCH_INTRA_OP_THREADS = int(os.getenv('TORCH_INTRA_OP_THREADS', '0'))
+TORCH_INTER_OP_THREADS = int(os.getenv('TORCH_INTER_OP_THREADS', '0'))
+
+
+def configure_threads(intra_op=TORCH_INTRA_OP_THREADS, inter_op=TORCH_INTER_OP_THREADS):
+    """Size torch's CPU thread pools; call before the first forward pass"""
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # Only possible before any inter-op parallel work has started
+            logger.warning(f"Could not set {inter_op} inter-op threads: {e}")
+    logger.info(
+        f"Torch using {torch.get_num_threads()} intra-op / "
+        f"{torch.get_num_interop_threads()} inter-op threads"
+    )
+
+
+def mean_pool(hidden_state, attention_mask):
+    """Sentence embedding: mean of the last hidden state over the non-padding tokens"""
+    mask = attention_mask.unsqueeze(-1).to(hidden_state.dtype)
+    return (hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+
+class EagerBackend:
+    """
+    Plain fp32 PyTorch forward pass (the original behavior). With a
+    compile_mode the model is also traced and frozen (torchscript) or
+    compiled (torch.compile) once; if that fails the plain model is used.
+    """
+    name = 'eager'
+
+    def __init__(self, model, device, compile_mode=CLASSIFIER_COMPILE):
+        self.model = model
+        self.device = device
+        # Once here, not per request
+        self.model.eval()
+        self.compile_mode = 'off'
+        self._compiled = None
+        if compile_mode not in ('off', 'none', ''):
+            self._compile(compile_mode)
+
+    def _compile(self, mode):
+        module = _InferenceModule(self.model).eval()
+        example = torch.ones(2, 16, dtype=torch.long, device=self.device)
+        try:
+            with torch.no_grad():
+                if mode == 'torchscript':
+                    compiled = torch.jit.freeze(torch.jit.trace(module, (example, example), strict=False))
+                elif mode == 'compile':
+                    compiled = torch.compile(module, dynamic=True)
+                else:
+                    raise ValueError(f"Unknown CLASSIFIER_COMPILE: {mode} (expected off, torchscript or compile)")
+            # torch.compile is lazy; run once so a failure surfaces here
+            with torch.inference_mode():
+                compiled(example, example)
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.warning(f"CLASSIFIER_COMPILE={mode} failed, using the uncompiled model: {e}")
+            return
+        self._compiled = compiled
+        self.compile_mode = mode
+        logger.info(f"Classifier model compiled with {mode}")
+
+    def logits(self, input_ids, attention_mask):
+        return self.forward(input_ids, attention_mask)[0]
+
+    def forward(self, input_ids, attention_mask, embed=False):
+        """
+        (logits, embeddings) for a padded batch. With embed, embeddings is the
+        mean-pooled last hidden state of the same pass, otherwise None.
+        """
+        attention_mask = attention_mask.to(self.device)
+        # inference_mode also skips autograd's version counting and view tracking
+        with torch.inference_mode():
+            if self._compiled is not None:
+                # The compiled graph always returns the embedding; it is nearly free
+                logits, embeddings = self._compiled(input_ids.to(self.device), attention_mask)
+                return logits.float().cpu(), embeddings.float().cpu() if embed else None
+            outputs = self.model(
+                input_ids=input_ids.to(self.device),
+                attention_mask=attention_mask,
+                output_hidden_states=embed
+            )
+        embeddings = None
+        if embed:
+            embeddings = mean_pool(outputs.hidden_states[-1], attention_mask).float().cpu()
+        return outputs.logits.float().cpu(), embeddings
+
+
+class QuantizedBackend(EagerBackend):
+    """PyTorch dynamic int8 quantization of every nn.Linear layer (CPU only)"""
+    name = 'int8'
+
+    def __init__(self, model, device, compile_mode=CLASSIFIER_COMPILE):
+        if device.type != 'cpu':
+            raise ValueError("int8 dynamic quantization is only supported on CPU")
+        model.eval()
+        # Quantize in place so the fp32 Linear weights are released
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        super().__init__(model, device, compile_mode=compile_mode)
+
+
+class OnnxExportUnavailable(RuntimeError):
+    """The model version has no usable ONNX export (missing, stale or without the embedding output)"""
+
+
+class OnnxBackend:
+    """
+    ONNX export of the fine-tuned model served through ONNX Runtime. The
+    export is written when the version is published; published versions are
+    never modified, so a version without a usable export is refused here.
+    """
+    name = 'onnx'
+    # ONNX Runtime optimizes the graph itself (ORT_ENABLE_ALL)
+    compile_mode = 'off'
+
+    def __init__(self, model, device, onnx_path, source_path=None):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "CLASSIFIER_BACKEND=onnx requires the onnxruntime package "
+                "(pip install onnxruntime)"
+            ) from e
+
+        if not os.path.exists(onnx_path):
+            raise OnnxExportUnavailable(f"{onnx_path} does not exist")
+        if source_path is not None and os.path.getmtime(onnx_path) < os.path.getmtime(source_path):
+            raise OnnxExportUnavailable(f"{onnx_path} is older than {source_path}")
+
+        self.onnx_path = onnx_path
+        self.reload(TORCH_INTRA_OP_THREADS)
+        if 'embedding' not in {output.name for output in self.session.get_outputs()}:
+            raise OnnxExportUnavailable(f"{onnx_path} was exported without the embedding output")
+        # The torch weights are not needed once the session is built
+        self.model = None
+        self.device = device
+        logger.info(f"ONNX Runtime session loaded from {onnx_path}")
+
+    def reload(self, num_threads=0):
+        """(Re)create the Runtime session, e.g. in a freshly forked worker"""
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            self.onnx_path, options, providers=['CPUExecutionProvider']
+        )
+
+    def logits(self, input_ids, attention_mask):
+        return self.forward(input_ids, attention_mask)[0]
+
+    def forward(self, input_ids, attention_mask, embed=False):
+        """(logits, embeddings or None), as EagerBackend.forward"""
+        outputs = self.session.run(
+            ['logits', 'embedding'] if embed else ['logits'],
+            {
+                'input_ids': input_ids.cpu().numpy(),
+                'attention_mask': attention_mask.cpu().numpy(),
+            }
+        )
+        embeddings = torch.from_numpy(outputs[1]).float() if embed else None
+        return torch.from_numpy(outputs[0]).float(), embeddings
+
+
+class _InferenceModule(torch.nn.Module):
+    """Exported / compiled graph: logits plus the mean-pooled embedding of the same pass"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+        return outputs.logits, mean_pool(outputs.hidden_states[-1], attention_mask)
+
+
+def export_onnx(model, onnx_path):
+    """
+    Export a sequence classification model with dynamic batch and sequence
+    axes; outputs are logits and the sentence embedding
+    """
+    logger.info(f"Exporting ONNX model to {onnx_path}")
+    model = _InferenceModule(model.to('cpu').eval()).eval()
+    dummy = torch.ones(1, 8, dtype=torch.long)
+    export_kwargs = {}
+    # Newer torch defaults to the dynamo exporter; keep the TorchScript one
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False
+    # Unique per process, in case two processes export the same path at once
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    torch.onnx.export(
+        model,
+        (dummy, torch.ones_like(dummy)),
+        tmp_path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits', 'embedding'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'},
+            'embedding': {0: 'batch'},
+        },
+        opset_version=14,
+        **export_kwargs
+    )
+    os.replace(tmp_path, onnx_path)
+
+
+def create_backend(name, model, device, onnx_path=None, source_path=None):
+    """Build the inference backend selected by name"""
+    name = (name or 'eager').lower()
+    if name == 'eager':
+        return EagerBackend(model, device)
+    if name == 'int8':
+        return QuantizedBackend(model, device)
+    if name == 'onnx':
+        if onnx_path is None:
+            raise ValueError("onnx backend requires an onnx_path")
+        try:
+            return OnnxBackend(model, device, onnx_path, source_path=source_path)
+        except OnnxExportUnavailable as e:
+            logger.warning(
+                f"{e}; serving this version with the eager backend. Versions published with "
+                f"CLASSIFIER_BACKEND=onnx or MODEL_EXPORT_ONNX=true include an export"
+            )
+            return EagerBackend(model, device)
+    raise ValueError(f"Unknown classifier backend: {name} (expected eager, int8 or onnx)")
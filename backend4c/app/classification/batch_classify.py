@@ -0,0 +1,104 @@
+"""
+Offline bulk classification of a query CSV.
+
+Streams the input (same Query column format as customer_queries.csv) in
+chunks, classifies each chunk in batches and appends the predictions to the
+output CSV as it goes, so memory stays bounded regardless of input size.
+With --user-id the predictions are also stored as issues for that user, one
+transaction per chunk.
+
+Usage:
+    python -m app.classification.batch_classify tickets.csv predictions.csv
+    python -m app.classification.batch_classify tickets.csv predictions.csv --user-id 1
+"""
+import argparse
+import csv
+import sys
+import time
+import pandas as pd
+from .issue_classification import IssueClassifier
+from .. import crud, similarity
+from ..database import SessionLocal
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def classify_csv(input_file, output_file, batch_size=64, chunk_size=10000,
+                 query_column='Query', user_id=None, classifier=None):
+    """Classify every row of input_file and write predictions to output_file"""
+    classifier = classifier or IssueClassifier()
+    if not classifier.is_trained:
+        raise RuntimeError("No trained model found; train the classifier first")
+
+    db = None
+    if user_id is not None:
+        db = SessionLocal()
+
+    total = 0
+    start = time.perf_counter()
+    try:
+        with open(output_file, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow([query_column, 'product_code', 'product_name', 'confidence'])
+
+            reader = pd.read_csv(input_file, usecols=[query_column], chunksize=chunk_size)
+            for chunk in reader:
+                queries = chunk[query_column].fillna('').astype(str).tolist()
+                predictions = []
+                for i in range(0, len(queries), batch_size):
+                    predictions.extend(classifier.classify_batch(queries[i:i + batch_size]))
+
+                writer.writerows(
+                    (query, result.product_code, result.product_name, f"{result.confidence:.4f}")
+                    for query, result in zip(queries, predictions)
+                )
+                out.flush()
+
+                if db is not None:
+                    issue_ids = crud.create_user_issues(db, user_id=user_id, issues=[
+                        {
+                            "query": query,
+                            "product_code": result.product_code,
+                            "product_name": result.product_name,
+                            "response": f"This appears to be a {result.product_name} related issue"
+                        }
+                        for query, result in zip(queries, predictions)
+                    ])
+                    similarity.record(issue_ids, predictions)
+
+                total += len(queries)
+                elapsed = time.perf_counter() - start
+                logger.info(f"Classified {total} queries ({total / elapsed:.1f} queries/s)")
+    finally:
+        if db is not None:
+            db.close()
+
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify a CSV of customer queries")
+    parser.add_argument('input', help="CSV with a Query column")
+    parser.add_argument('output', help="CSV to write predictions to")
+    parser.add_argument('--batch-size', type=int, default=64, help="queries per forward pass")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="rows read and written at a time")
+    parser.add_argument('--query-column', default='Query')
+    parser.add_argument('--user-id', type=int, default=None,
+                        help="also store the predictions as issues for this user")
+    args = parser.parse_args(argv)
+
+    total = classify_csv(
+        args.input,
+        args.output,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        query_column=args.query_column,
+        user_id=args.user_id,
+    )
+    logger.info(f"Wrote {total} predictions to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
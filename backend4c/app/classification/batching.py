@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from collections import deque
+from ..utils import metrics
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+QUEUE_DEPTH = metrics.gauge('classifier_queue_depth', 'Queries waiting for a batch')
+BATCHES_IN_FLIGHT = metrics.gauge('classifier_batches_in_flight', 'Batches being classified')
+BATCH_SIZE = metrics.histogram(
+    'classifier_batch_size', 'Queries per dispatched batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+QUEUE_WAIT_SECONDS = metrics.histogram('classifier_queue_wait_seconds', 'Time a query waits before its batch is dispatched')
+BATCH_SECONDS = metrics.histogram('classifier_batch_seconds', 'Time to classify one batch, end to end')
+
+# Batching knobs, overridable from the environment
+MAX_BATCH_SIZE = int(os.getenv('CLASSIFY_MAX_BATCH_SIZE', '32'))
+MAX_WAIT_MS = float(os.getenv('CLASSIFY_MAX_WAIT_MS', '5'))
+
+
+class ClassificationBatcher:
+    """
+    Gathers concurrent classify requests into one batch and runs
+    IssueClassifier.classify_batch off the event loop.
+
+    A batch is dispatched as soon as it holds max_batch_size queries or the
+    oldest query has waited max_wait_ms, whichever comes first. Queries found
+    in the optional result cache never reach the queue. Up to max_concurrency
+    batches run at once (one per inference worker process in pool mode).
+    """
+
+    def __init__(self, classifier, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 executor=None, cache=None, max_concurrency=1):
+        self.classifier = classifier
+        self.cache = cache
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.executor = executor
+        self._pending = deque()
+        self._has_items = None
+        self._batch_full = None
+        self._worker = None
+
+    @property
+    def running(self):
+        return self._worker is not None and not self._worker.done()
+
+    def start(self):
+        """Start the background dispatch task on the running event loop"""
+        if self.running:
+            return
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+        QUEUE_DEPTH.set_function(lambda: len(self._pending))
+        logger.info(
+            f"Classification batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f}, max_concurrency={self.max_concurrency})"
+        )
+
+    async def stop(self):
+        """Stop the dispatch task and fail any queries still waiting"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while self._pending:
+            _, future, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("Classification batcher stopped"))
+        logger.info("Classification batcher stopped")
+
+    async def classify(self, query):
+        """Queue a query and wait for its ClassificationResult"""
+        if not self.running:
+            raise RuntimeError("Classification batcher is not running")
+        version = self.classifier.model_version
+        if self.cache is not None:
+            result = self.cache.get(query, version)
+            if result is not None:
+                return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, future, time.perf_counter()))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        result = await future
+
+        if self.cache is not None:
+            self.cache.put(query, version, result)
+        return result
+
+    async def _next_batch(self):
+        await self._has_items.wait()
+        if len(self._pending) < self.max_batch_size and self.max_wait > 0:
+            self._batch_full.clear()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+
+        batch = []
+        now = time.perf_counter()
+        while self._pending and len(batch) < self.max_batch_size:
+            query, future, enqueued_at = self._pending.popleft()
+            # Skip callers that have already gone away
+            if not future.done():
+                batch.append((query, future))
+                QUEUE_WAIT_SECONDS.observe(now - enqueued_at)
+        if not self._pending:
+            self._has_items.clear()
+        return batch
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.max_concurrency)
+        in_flight = set()
+
+        def _done(task):
+            in_flight.discard(task)
+            slots.release()
+
+        try:
+            while True:
+                await slots.acquire()
+                batch = await self._next_batch()
+                if not batch:
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._dispatch(batch))
+                in_flight.add(task)
+                task.add_done_callback(_done)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        queries = [query for query, _ in batch]
+        BATCH_SIZE.observe(len(queries))
+        BATCHES_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(
+                self.executor, self.classifier.classify_batch, queries
+            )
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Classification batcher stopped"))
+            raise
+        except Exception as e:
+            logger.error(f"Error classifying batch of {len(batch)}: {str(e)}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            BATCHES_IN_FLIGHT.dec()
+        BATCH_SECONDS.observe(time.perf_counter() - start)
+
+        logger.debug(f"Classified batch of {len(batch)} queries")
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from ..utils import metrics
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_LOOKUPS = metrics.counter('classifier_cache_lookups_total', 'Result cache lookups', ['result'])
+CACHE_EVICTIONS = metrics.counter('classifier_cache_evictions_total', 'Result cache LRU evictions')
+
+# Result cache knobs; CLASSIFY_CACHE_SIZE=0 disables caching
+CACHE_SIZE = int(os.getenv('CLASSIFY_CACHE_SIZE', '10000'))
+CACHE_TTL_SECONDS = float(os.getenv('CLASSIFY_CACHE_TTL_SECONDS', '3600'))
+
+
+def normalize_query(query):
+    """
+    Cache key for a query. The tokenizer is uncased and ignores runs of
+    whitespace, so queries that differ only in case or spacing classify
+    identically and can share an entry.
+    """
+    return " ".join(str(query).lower().split())
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of classification results keyed on the normalized query.
+
+    Entries expire after ttl_seconds, and the whole cache is dropped as soon
+    as it is asked about a different model version than the one it holds.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl_seconds)
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                logger.info(f"Model version changed to {version}; clearing {len(self._entries)} cached results")
+            self._entries.clear()
+            self.version = version
+
+    def get(self, query, version):
+        """Return the cached result for query under model version, or None"""
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc(result='hit')
+                    return result
+                del self._entries[key]
+            self.misses += 1
+            CACHE_LOOKUPS.inc(result='miss')
+            return None
+
+    def put(self, query, version, result):
+        """Store result for query; ignored if the model changed in the meantime"""
+        key = normalize_query(query)
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVICTIONS.inc()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "model_version": self.version,
+            }
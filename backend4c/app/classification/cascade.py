@@ -0,0 +1,132 @@
+"""
+Cheap first tier of the classifier cascade.
+
+A TF-IDF + logistic regression model fitted on the same data as the
+transformer and stored next to it in every model version
+(first_tier.joblib). With CLASSIFY_CASCADE enabled, IssueClassifier answers
+a query from this tier when its top probability reaches CASCADE_THRESHOLD
+and only runs DistilBERT on the queries that fall through, so easy queries
+("my Printer won't print") skip the transformer forward pass.
+"""
+import os
+import threading
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from ..database import TRAINING_DATA_PATH
+from ..utils import metrics
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CASCADE_QUERIES = metrics.counter(
+    'classifier_cascade_queries_total', 'Classified queries by the cascade tier that answered them', ['tier']
+)
+
+# Answer from the first tier when it is confident, else fall through to DistilBERT
+CASCADE_ENABLED = os.getenv('CLASSIFY_CASCADE', 'false').lower() in ('1', 'true', 'yes')
+# Minimum first-tier probability for its answer to be used
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '0.9'))
+FIRST_TIER_FILENAME = 'first_tier.joblib'
+
+
+class FirstTier:
+    """TF-IDF word/bigram features + multinomial logistic regression"""
+
+    def __init__(self, pipeline, num_labels):
+        self.pipeline = pipeline
+        self.num_labels = num_labels
+        # Labels absent from the training data get no column from predict_proba
+        self.columns = np.asarray(pipeline.classes_, dtype=np.int64)
+
+    @classmethod
+    def fit(cls, texts, labels, num_labels):
+        pipeline = make_pipeline(
+            TfidfVectorizer(lowercase=True, ngram_range=(1, 2), sublinear_tf=True, min_df=1),
+            LogisticRegression(max_iter=1000, C=10.0),
+        )
+        pipeline.fit([str(text) for text in texts], np.asarray(labels, dtype=np.int64))
+        logger.info(f"First tier fitted on {len(texts)} examples")
+        return cls(pipeline, num_labels)
+
+    def predict_proba(self, texts):
+        """(len(texts), num_labels) float32 probabilities, columns indexed by product code"""
+        probs = np.zeros((len(texts), self.num_labels), dtype=np.float32)
+        probs[:, self.columns] = self.pipeline.predict_proba([str(text) for text in texts])
+        return probs
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        joblib.dump({'pipeline': self.pipeline, 'num_labels': self.num_labels}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        state = joblib.load(path)
+        return cls(state['pipeline'], state['num_labels'])
+
+
+def read_training_examples(train_file, label2idx):
+    """(texts, labels) from a training CSV with Query and Product columns"""
+    df = pd.read_csv(train_file, usecols=['Query', 'Product']).dropna()
+    labels = df['Product'].map(label2idx)
+    df = df[labels.notna()]
+    return df['Query'].astype(str).tolist(), labels[labels.notna()].astype(int).tolist()
+
+
+def load_first_tier(artifact_path, label2idx, train_file=TRAINING_DATA_PATH):
+    """
+    The first tier stored with a model version. Versions published before
+    the cascade existed get one fitted on train_file, saved for next time.
+    Returns None if neither is possible.
+    """
+    path = os.path.join(artifact_path, FIRST_TIER_FILENAME)
+    if os.path.exists(path):
+        return FirstTier.load(path)
+    logger.info(f"No first tier in {artifact_path}; fitting one on {train_file}")
+    try:
+        texts, labels = read_training_examples(train_file, label2idx)
+        first_tier = FirstTier.fit(texts, labels, len(label2idx))
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not fit the first tier: {str(e)}")
+        return None
+    try:
+        first_tier.save(path)
+    except OSError as e:
+        logger.warning(f"Could not save the first tier to {path}: {str(e)}")
+    return first_tier
+
+
+class CascadeStats:
+    """Per-process counts of queries answered by each tier"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.first_tier = 0
+        self.transformer = 0
+
+    def record(self, results):
+        first_tier = sum(1 for result in results if result.tier == 'first_tier')
+        transformer = len(results) - first_tier
+        with self._lock:
+            self.first_tier += first_tier
+            self.transformer += transformer
+        if first_tier:
+            CASCADE_QUERIES.inc(first_tier, tier='first_tier')
+        if transformer:
+            CASCADE_QUERIES.inc(transformer, tier='transformer')
+
+    def stats(self):
+        with self._lock:
+            total = self.first_tier + self.transformer
+            return {
+                "first_tier": self.first_tier,
+                "fall_through": self.transformer,
+                "fall_through_rate": self.transformer / total if total else 0.0,
+            }
+
+
+STATS = CascadeStats()
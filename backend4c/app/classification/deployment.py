@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+import threading
+from datetime import datetime
+from . import registry
+from ..database import TRAINING_DATA_PATH
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Seconds between checks of CURRENT for a version published elsewhere; 0 disables
+MODEL_RELOAD_INTERVAL_SECONDS = float(os.getenv('MODEL_RELOAD_INTERVAL_SECONDS', '30'))
+# Start a background training run at startup when no trained model exists
+MODEL_AUTO_TRAIN = os.getenv('MODEL_AUTO_TRAIN', 'true').lower() in ('1', 'true', 'yes')
+
+# Module run by the training subprocess ("app" or "backend4c.app" prefix),
+# and the directory it has to be importable from
+TRAIN_MODULE = f"{__name__.rsplit('.', 1)[0]}.train"
+_IMPORT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), *['..'] * __name__.count('.')))
+
+
+class ModelManager:
+    """
+    Trains new model versions in a separate process and hot-swaps them in.
+
+    A background thread watches CURRENT (every reload_interval seconds, and
+    right after a training run finishes) and loads any new version into the
+    classifier while the old one keeps serving. When an inference pool is
+    in use, its workers are re-forked from the new model afterwards, and
+    on_swap (if given) is called once the new version is serving.
+    """
+
+    def __init__(self, classifier, pool=None, reload_interval=MODEL_RELOAD_INTERVAL_SECONDS, on_swap=None):
+        self.classifier = classifier
+        self.pool = pool
+        self.on_swap = on_swap
+        self.reload_interval = max(0.0, float(reload_interval))
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._process = None
+        self.training = {"state": "idle"}
+        self.last_reload_error = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching for new versions; a running training job is left to finish"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def start_training(self, train_file=TRAINING_DATA_PATH, incremental=False):
+        """Launch a (full or incremental) training run; returns False if one is already running"""
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return False
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.pathsep.join(filter(None, [_IMPORT_ROOT, env.get('PYTHONPATH')]))
+            command = [sys.executable, '-m', TRAIN_MODULE, '--data', train_file]
+            if incremental:
+                command.append('--incremental')
+            self._process = subprocess.Popen(command, env=env)
+            self.training = {
+                "state": "running",
+                "mode": "incremental" if incremental else "full",
+                "pid": self._process.pid,
+                "train_file": train_file,
+                "started_at": datetime.now().isoformat(timespec='seconds'),
+            }
+            process = self._process
+        mode = "incremental" if incremental else "full"
+        logger.info(f"Started background {mode} training (pid {process.pid}) on {train_file}")
+        threading.Thread(target=self._wait_for_training, args=(process,),
+                         name="model-training", daemon=True).start()
+        return True
+
+    def _wait_for_training(self, process):
+        returncode = process.wait()
+        with self._lock:
+            self.training = {
+                **self.training,
+                "state": "succeeded" if returncode == 0 else "failed",
+                "returncode": returncode,
+                "finished_at": datetime.now().isoformat(timespec='seconds'),
+            }
+        if returncode == 0:
+            logger.info("Background training finished")
+            self._wake.set()
+        else:
+            logger.error(f"Background training failed with exit code {returncode}")
+
+    def activate(self, version):
+        """Point CURRENT at a published version (e.g. to roll back) and load it"""
+        registry.set_current_version(version)
+        return self.reload()
+
+    def reload(self):
+        """Load the version CURRENT points at if it is not the live one"""
+        with self._reload_lock:
+            try:
+                swapped = self.classifier.reload()
+                if swapped and self.pool is not None:
+                    self.pool.restart()
+                if swapped and self.on_swap is not None:
+                    self.on_swap()
+                self.last_reload_error = None
+                return swapped
+            except Exception as e:
+                self.last_reload_error = str(e)
+                logger.error(f"Error loading new model version: {str(e)}", exc_info=True)
+                return False
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.reload_interval or None)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.reload()
+
+    def status(self):
+        with self._lock:
+            training = dict(self.training)
+        versions = registry.list_versions()
+        return {
+            "live_version": self.classifier.model_version,
+            "current_version": registry.current_version(),
+            "is_trained": self.classifier.is_trained,
+            "backend": self.classifier.backend_name,
+            "pool_version": self.pool.model_version if self.pool is not None else None,
+            "last_reload_error": self.last_reload_error,
+            "training": training,
+            "versions": [
+                {"version": version, **registry.read_metadata(version)}
+                for version in reversed(versions)
+            ],
+        }
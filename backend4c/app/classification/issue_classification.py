@@ -1,234 +1,660 @@
+import logging
 import torch
 import pandas as pd
-import numpy as np
 from transformers import (
     DistilBertTokenizerFast, 
     DistilBertForSequenceClassification,
-    Trainer, 
+    DataCollatorWithPadding,
     TrainingArguments
 )
-from torch.utils.data import Dataset
 import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+from . import cascade, registry, vector_index
+from .backends import CLASSIFIER_BACKEND, EXPORT_ONNX, create_backend, export_onnx
+from .training_data import ExampleDataset, TokenizedTrainer, load_tokenized_dataset, replay_sample
+from .. import crud, models
+from ..database import MODEL_DIRECTORY, MODEL_PATH, TRAINING_DATA_PATH, SessionLocal
+from ..utils import metrics
 from ..utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
-class IssueDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_len=256):
-        self.texts = texts
-        self.labels = labels.astype(np.int32)  # Convert labels to int32
-        self.tokenizer = tokenizer
-        self.max_len = max_len
-        logger.debug(f"Dataset initialized with {len(texts)} examples")
-        logger.debug(f"Label types: {self.labels.dtype}")
-        logger.debug(f"Label range: {np.min(self.labels)} to {np.max(self.labels)}")
+CLASSIFY_STAGE_SECONDS = metrics.histogram(
+    'classifier_stage_seconds', 'Time per classify_batch stage (per batch)', ['stage']
+)
 
-    def __len__(self):
-        return len(self.texts)
+# Alternatives (with their probabilities) returned with every prediction
+TOP_K = int(os.getenv('CLASSIFY_TOP_K', '3'))
+# Longest sequence we ever feed the model; shorter inputs are only padded
+# to the longest sequence in their batch
+MAX_SEQ_LEN = 256
+# Max queries per length bucket in a single forward pass
+BUCKET_SIZE = int(os.getenv('CLASSIFY_BUCKET_SIZE', '16'))
+# (batch size)x(sequence length) shapes run through every newly loaded model
+# version before it serves, so the first real requests don't pay for lazy
+# allocations, kernel selection or graph compilation; empty to skip
+WARMUP_SHAPES = os.getenv('CLASSIFY_WARMUP_SHAPES', '1x16,1x64,8x32,16x64,16x128')
+# DataLoader worker processes feeding the Trainer
+TRAIN_DATALOADER_WORKERS = int(os.getenv('TRAIN_DATALOADER_WORKERS', '2'))
+# Trainer checkpoints (published versions live in MODEL_VERSIONS_PATH)
+TRAINING_OUTPUT_PATH = os.path.join(MODEL_DIRECTORY, 'checkpoints')
+# Incremental retraining: epochs and learning rate when continuing from the
+# current version, and replayed training-CSV examples per new example
+INCREMENTAL_EPOCHS = float(os.getenv('INCREMENTAL_EPOCHS', '2'))
+INCREMENTAL_LEARNING_RATE = float(os.getenv('INCREMENTAL_LEARNING_RATE', '2e-5'))
+INCREMENTAL_REPLAY_RATIO = float(os.getenv('INCREMENTAL_REPLAY_RATIO', '1.0'))
+# Also learn from uncorrected issues, labelled with the model's own prediction
+INCREMENTAL_USE_PREDICTIONS = os.getenv('INCREMENTAL_USE_PREDICTIONS', 'false').lower() in ('1', 'true', 'yes')
 
-    def __getitem__(self, idx):
-        text = str(self.texts[idx])
-        label = int(self.labels[idx])  # Explicitly convert to int
-        
-        encoding = self.tokenizer.encode_plus(
-            text,
-            add_special_tokens=True,
-            max_length=self.max_len,
-            return_token_type_ids=False,
-            padding='max_length',
-            truncation=True,
-            return_attention_mask=True,
-            return_tensors='pt',
-        )
-        
+
+class ModelNotReadyError(RuntimeError):
+    """Raised by classify_batch while no trained model has been loaded"""
+
+
+class ClassificationResult(NamedTuple):
+    """
+    Prediction for one query: the best product, its probability, the top_k
+    best (product_code, product_name, confidence), best first, and which
+    cascade tier answered (first_tier or transformer). With embeddings on,
+    transformer answers also carry the query's L2-normalized float16
+    sentence embedding from the same forward pass, and the model version
+    that produced it.
+    """
+    product_code: int
+    product_name: str
+    confidence: float
+    top_k: Tuple[Tuple[int, str, float], ...]
+    tier: str = 'transformer'
+    embedding: Optional[np.ndarray] = None
+    model_version: Optional[str] = None
+
+
+def observe_batch(results, timings):
+    """Record a classify_batch_timed outcome: stage timings and the tier of each result"""
+    for stage, seconds in timings.items():
+        CLASSIFY_STAGE_SECONDS.observe(seconds, stage=stage)
+    cascade.STATS.record(results)
+
+
+def length_buckets(lengths, bucket_size=BUCKET_SIZE):
+    """
+    Group indices into buckets of similar sequence length so each bucket
+    only pads to its own longest member. Returns lists of original indices.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    bucket_size = max(1, bucket_size)
+    return [order[i:i + bucket_size] for i in range(0, len(order), bucket_size)]
+
+
+def parse_warmup_shapes(spec):
+    """[(batch size, sequence length), ...] from '1x16,8x32'; lengths are capped at MAX_SEQ_LEN"""
+    shapes = []
+    for item in spec.replace(' ', '').split(','):
+        if not item:
+            continue
         try:
-            return {
-                'input_ids': encoding['input_ids'].flatten(),
-                'attention_mask': encoding['attention_mask'].flatten(),
-                'labels': torch.tensor(label, dtype=torch.long)
-            }
-        except Exception as e:
-            logger.error(f"Error creating tensor for idx {idx}, label {label}")
-            logger.error(f"Label type: {type(label)}")
-            logger.error(f"Error: {str(e)}")
-            raise
+            batch, length = (int(n) for n in item.lower().split('x'))
+        except ValueError:
+            raise ValueError(f"Invalid warmup shape {item!r} (expected BATCHxLENGTH, e.g. 8x32)")
+        shapes.append((max(1, batch), max(2, min(length, MAX_SEQ_LEN))))
+    return shapes
+
+class ModelRuntime:
+    """
+    Everything classify_batch needs for one model version. The classifier
+    holds exactly one and replaces it with a single assignment, so a batch
+    always runs entirely against either the old or the new version.
+    """
+    def __init__(self, tokenizer, backend, version, path=None, first_tier=None):
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.version = version
+        self.path = path
+        # Cascade first tier for this version; None when the cascade is off
+        self.first_tier = first_tier
+        # Time spent warming this version up in this process; None until warmed
+        self.warmup_seconds = None
 
 class IssueClassifier:
-    def __init__(self):
+    def __init__(self, backend=None, load=True, cascade_enabled=None, cascade_threshold=None, embeddings=None):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         logger.info(f"Using device: {self.device}")
         
-        # Product mapping
-        self.products = [
+        # Product mapping; products[code] is the name for a model output index
+        self.products = (
             'Printer', 'Scanner', 'Laptop', 'Monitor', 'Keyboard', 
             'Mouse', 'Projector', 'Fax machine', 'Calculator', 'Shredder',
             'Photocopier', 'Whiteboard', 'Paper shredder', 'Desk lamp',
             'External hard drive', 'Conference phone', 'Label maker', 
             'Document camera', 'Wireless presenter', 'USB hub'
-        ]
+        )
         self.label2idx = {label: idx for idx, label in enumerate(self.products)}
         self.idx2label = {idx: label for label, idx in self.label2idx.items()}
         
         logger.info(f"Initialized with {len(self.products)} product categories")
         logger.debug(f"Product mapping: {self.label2idx}")
         
-        # Initialize tokenizer and model
-        self.tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased")
-        self.model = DistilBertForSequenceClassification.from_pretrained(
-            "distilbert-base-uncased", 
-            num_labels=len(self.products)
-        )
+        # Inference backend (eager fp32, int8 or onnx), built once weights are loaded
+        self.backend_name = backend or CLASSIFIER_BACKEND
+        # Cheap-first cascade: queries the first tier is confident about skip DistilBERT
+        self.cascade_enabled = cascade.CASCADE_ENABLED if cascade_enabled is None else cascade_enabled
+        self.cascade_threshold = cascade.CASCADE_THRESHOLD if cascade_threshold is None else cascade_threshold
+        # Sentence embeddings for similar-issue search, pooled from the classification pass
+        self.embeddings_enabled = vector_index.SIMILAR_ISSUES_ENABLED if embeddings is None else embeddings
+        # Loaded model version; None until a trained model is available
+        self.runtime = None
+        self._swap_lock = threading.Lock()
         
-        # Check if saved model exists
-        model_path = './data4c/results/model_distill_bert.pth'
-        if os.path.exists(model_path):
-            try:
-                logger.info(f"Loading saved model from {model_path}")
-                self.model.load_state_dict(torch.load(model_path, map_location=self.device))
-                logger.info("Model loaded successfully")
-                self.model.eval()  # Set model to evaluation mode
-            except Exception as e:
-                logger.error(f"Error loading saved model: {str(e)}")
-                logger.info("Initializing new model instead")
+        if not load:
+            return
+        version = registry.current_version() or registry.migrate_legacy_artifact()
+        if version is not None:
+            self.load_version(version)
+        elif os.path.exists(MODEL_PATH):
+            self._migrate_state_dict(MODEL_PATH)
         else:
             logger.info("No saved model found. Model will need training before use.")
+
+    @property
+    def is_trained(self):
+        return self.runtime is not None
+
+    @property
+    def model_version(self):
+        """Changes whenever different weights are loaded (used to invalidate caches)"""
+        runtime = self.runtime
+        return runtime.version if runtime is not None else 'untrained'
+
+    @property
+    def backend(self):
+        runtime = self.runtime
+        return runtime.backend if runtime is not None else None
+
+    @property
+    def tokenizer(self):
+        runtime = self.runtime
+        return runtime.tokenizer if runtime is not None else None
+
+    def _load_base_model(self):
+        """Untrained DistilBERT with a fresh classification head (needs the HF hub or cache)"""
+        tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased")
+        model = DistilBertForSequenceClassification.from_pretrained(
+            "distilbert-base-uncased", 
+            num_labels=len(self.products),
+            id2label=self.idx2label,
+            label2id=self.label2idx
+        )
+        return tokenizer, model.to(self.device)
+
+    def _load_artifact(self, path):
+        """
+        Load tokenizer and weights from a saved artifact. Works offline, and the
+        safetensors weights are mmapped straight into the model instead of
+        being copied over a randomly initialized one.
+        """
+        logger.info(f"Loading model artifact from {path}")
+        tokenizer = DistilBertTokenizerFast.from_pretrained(path, local_files_only=True)
+        model = DistilBertForSequenceClassification.from_pretrained(
+            path,
+            local_files_only=True,
+            low_cpu_mem_usage=True,
+        )
+        return tokenizer, model.to(self.device)
+
+    def load_version(self, version):
+        """
+        Load a published version and swap it in. The current version keeps
+        serving until the new one is fully loaded. Returns True if swapped.
+        """
+        with self._swap_lock:
+            if version == self.model_version:
+                return False
+            path = registry.version_path(version)
+            tokenizer, model = self._load_artifact(path)
+            first_tier = cascade.load_first_tier(path, self.label2idx) if self.cascade_enabled else None
+            runtime = ModelRuntime(tokenizer, self._build_backend(model, path), version, path, first_tier)
+            # Warmed before the swap, so the new version is fast from its first request
+            self._warmup(runtime)
+            previous = self.model_version
+            self.runtime = runtime
+        logger.info(f"Model version {version} is live (was {previous}, {runtime.backend.name} backend)")
+        return True
+
+    def warmup(self, shapes=None):
+        """Warm the live version up (again), e.g. in a freshly forked worker; returns the seconds taken"""
+        runtime = self.runtime
+        return self._warmup(runtime, shapes) if runtime is not None else 0.0
+
+    def _warmup(self, runtime, shapes=None):
+        """
+        Run the backend on synthetic batches of each warmup shape, plus the
+        tokenizer, cascade first tier and postprocessing once
+        """
+        shapes = parse_warmup_shapes(WARMUP_SHAPES) if shapes is None else shapes
+        if not shapes:
+            runtime.warmup_seconds = 0.0
+            return 0.0
+        start = time.perf_counter()
+        tokenizer = runtime.tokenizer
+        tokenizer(["printer not working"], truncation=True, max_length=MAX_SEQ_LEN)
+        if runtime.first_tier is not None:
+            runtime.first_tier.predict_proba(["printer not working"])
+        for batch, length in shapes:
+            input_ids = torch.full((batch, length), tokenizer.unk_token_id, dtype=torch.long)
+            input_ids[:, 0] = tokenizer.cls_token_id
+            input_ids[:, -1] = tokenizer.sep_token_id
+            logits, embeddings = runtime.backend.forward(
+                input_ids, torch.ones_like(input_ids), embed=self.embeddings_enabled
+            )
+            self._postprocess(torch.softmax(logits, dim=-1), embeddings=embeddings)
+        runtime.warmup_seconds = time.perf_counter() - start
+        logger.info(
+            f"Warmed up model version {runtime.version} on {len(shapes)} shapes "
+            f"in {runtime.warmup_seconds:.2f}s"
+        )
+        return runtime.warmup_seconds
+
+    def reload(self):
+        """Swap to whatever version CURRENT points at, if it changed"""
+        version = registry.current_version()
+        if version is None:
+            return False
+        return self.load_version(version)
+
+    def _migrate_state_dict(self, model_path):
+        """One-off conversion of a legacy .pth state dict into a model version"""
+        logger.info(f"Converting legacy model {model_path} to a model version")
+        tokenizer, model = self._load_base_model()
+        try:
+            model.load_state_dict(torch.load(model_path, map_location=self.device))
+        except Exception as e:
+            logger.error(f"Error loading saved model: {str(e)}")
+            logger.info("Model will need training before use.")
+            return
+        version = self.save_version(tokenizer, model, metadata={'migrated_from': model_path})
+        registry.set_current_version(version)
+        self.load_version(version)
+
+    def save_version(self, tokenizer, model, metadata=None, first_tier=None):
+        """
+        Write weights (safetensors), config and tokenizer, plus the cascade
+        first tier if given, as a new published version
+        """
+        version = registry.new_version()
+        os.makedirs(registry.MODEL_VERSIONS_PATH, exist_ok=True)
+        tmp_path = registry.version_path(f"{version}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        model.save_pretrained(tmp_path, safe_serialization=True)
+        tokenizer.save_pretrained(tmp_path)
+        if first_tier is not None:
+            first_tier.save(os.path.join(tmp_path, cascade.FIRST_TIER_FILENAME))
+        if self.backend_name == 'onnx' or EXPORT_ONNX:
+            # Exported here, once: serving processes only load the session
+            # and never write into a published version
+            export_onnx(model, os.path.join(tmp_path, 'model.onnx'))
+        registry.write_metadata(tmp_path, {
+            'version': version,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            **(metadata or {}),
+        })
+        registry.publish(tmp_path, version)
+        return version
+
+    def _build_backend(self, model, artifact_path):
+        """Wrap a loaded model in the configured inference backend"""
+        return create_backend(
+            self.backend_name,
+            model,
+            self.device,
+            onnx_path=os.path.join(artifact_path, 'model.onnx'),
+            source_path=os.path.join(artifact_path, 'model.safetensors')
+        )
+
+    def _fit(self, tokenizer, model, train_dataset, **overrides):
+        """Fine-tune model in place on train_dataset; returns the Trainer's TrainOutput"""
+        logger.info("\nLabel distribution:")
+        label_counts = train_dataset.label_counts()
+        label_dist = pd.Series(label_counts, index=self.products[:len(label_counts)])
+        logger.info(str(label_dist[label_dist > 0].sort_values(ascending=False)))
+        
+        # Training arguments
+        training_args = TrainingArguments(**{
+            'output_dir': TRAINING_OUTPUT_PATH,
+            'num_train_epochs': 5,
+            'per_device_train_batch_size': 16,
+            'group_by_length': True,  # batch similar lengths together
+            'warmup_steps': 500,
+            'weight_decay': 0.01,
+            'logging_dir': './data4c/logs',
+            'logging_steps': 10,
+            'save_steps': 10000,
+            'save_total_limit': 2,
+            'dataloader_num_workers': TRAIN_DATALOADER_WORKERS,
+            'dataloader_pin_memory': self.device.type == 'cuda',
+            'dataloader_persistent_workers': TRAIN_DATALOADER_WORKERS > 0,
+            **overrides,
+        })
+
+        # Initialize trainer
+        trainer = TokenizedTrainer(
+            model=model,
+            args=training_args,
+            train_dataset=train_dataset,
+            data_collator=DataCollatorWithPadding(tokenizer),
+        )
+
+        logger.info("Starting training...")
+        return trainer.train()
+
+    def _publish(self, tokenizer, model, metadata, activate, first_tier=None):
+        """Save a trained model as a new version and, with activate, make it live"""
+        version = self.save_version(tokenizer, model, metadata=metadata, first_tier=first_tier)
+        if not activate:
+            return version
+        registry.set_current_version(version)
+        registry.prune_versions()
+        self.load_version(version)
+        
+        # Test the model on sample queries
+        logger.info("\nTesting model on sample queries:")
+        test_queries = [
+            "How do I connect my printer to WiFi?",
+            "The scanner is not working",
+            "Laptop battery not charging",
+            "Monitor display is blank"
+        ]
+        for query in test_queries:
+            result = self.classify(query)
+            logger.info(f"Query: {query}")
+            logger.info(f"Predicted: {result.product_name} (code: {result.product_code}, "
+                        f"confidence: {result.confidence:.3f})\n")
         
-        self.model.to(self.device)
+        return version
 
-    def train(self, train_file='data4c/customer_queries.csv'):
+    def train(self, train_file=TRAINING_DATA_PATH, activate=True):
         """
-        Fine-tune the model on the training data
+        Fine-tune a fresh model on the training data and publish it as a new
+        version. With activate, CURRENT is pointed at it and it is loaded.
+        Returns the new version, or None if training failed.
         """
-        # Check if model is already trained
-        model_path = './data4c/results/model_distill_bert.pth'
-        if os.path.exists(model_path):
-            logger.info("Model already trained and saved. Skipping training.")
-            return True
-            
         logger.info(f"Starting training process...")
         logger.info(f"Loading training data from {train_file}")
         
         try:
-            # Load and prepare training data
-            df = pd.read_csv(train_file)
-            logger.info(f"Loaded {len(df)} training examples")
-            
-            # Convert product names to numeric labels
-            labels = pd.Series(df['Product'].map(self.label2idx))
+            tokenizer, model = self._load_base_model()
             
-            # Check for any NaN values in labels
-            if labels.isna().any():
-                invalid_products = df[labels.isna()]['Product'].unique()
-                logger.error(f"Found invalid product names: {invalid_products}")
-                raise ValueError(f"Invalid product names found: {invalid_products}")
-            
-            labels = labels.values
-            texts = df['Query'].values
+            # Tokenized once per version of the CSV and memory-mapped after that
+            train_dataset = load_tokenized_dataset(
+                train_file,
+                tokenizer,
+                max_len=MAX_SEQ_LEN,
+                label2idx=self.label2idx
+            )
+            result = self._fit(tokenizer, model, train_dataset)
+            # The TF-IDF first tier is always fitted (it takes seconds) and saved with
+            # the version, whether or not the cascade is enabled
+            first_tier = cascade.FirstTier.fit(
+                *cascade.read_training_examples(train_file, self.label2idx), len(self.products)
+            )
             
-            logger.info("Sample of training data:")
-            for i in range(min(5, len(df))):
-                logger.info(f"Text: {texts[i]}")
-                logger.info(f"Product: {df['Product'].iloc[i]} (Label: {labels[i]})")
+            # Save the model
+            return self._publish(tokenizer, model, activate=activate, first_tier=first_tier, metadata={
+                'mode': 'full',
+                'train_file': os.path.abspath(train_file),
+                'examples': len(train_dataset),
+                'training_loss': result.training_loss,
+            })
             
-            logger.info("\nLabel distribution:")
-            label_dist = pd.Series(df['Product']).value_counts()
-            logger.info(str(label_dist))
+        except Exception as e:
+            logger.error(f"Error during training: {str(e)}", exc_info=True)
+            return None
+
+    def train_incremental(self, train_file=TRAINING_DATA_PATH, activate=True):
+        """
+        Continue training the current version on issues logged since it was
+        trained, mixed with a replay sample of train_file so the model does
+        not drift away from the original data. Consumes corrected issues
+        (and, with INCREMENTAL_USE_PREDICTIONS, every new issue labelled
+        with its prediction) up to a high-water mark that is stored in the
+        new version's metadata for the next run to start from.
+        Returns the new version, the current one if there was nothing new
+        to learn, or None if training failed.
+        """
+        base_version = registry.current_version()
+        if base_version is None:
+            logger.info("No current model version; running full training instead")
+            return self.train(train_file, activate=activate)
+        base = registry.read_metadata(base_version)
+        logger.info(f"Starting incremental training from version {base_version}")
+        
+        try:
+            # Snapshot: corrections made until now and issues logged until now
+            cutoff = models.Issue.get_current_time()
+            corrected_after = base.get('corrections_cutoff')
+            db = SessionLocal()
+            try:
+                high_water_mark = crud.get_max_issue_id(db)
+                rows = crud.get_training_issues(
+                    db,
+                    corrected_after=datetime.fromisoformat(corrected_after) if corrected_after else None,
+                    corrected_until=cutoff,
+                    after_id=base.get('issue_high_water_mark', 0) if INCREMENTAL_USE_PREDICTIONS else None,
+                    up_to_id=high_water_mark,
+                )
+            finally:
+                db.close()
+            # Placeholder codes (e.g. 999 "Unknown") are not trainable labels
+            rows = [row for row in rows if row[2] in self.idx2label]
+            if not rows:
+                logger.info(f"No new labelled issues since version {base_version}; nothing to train")
+                return base_version
             
-            # Create dataset
-            train_dataset = IssueDataset(
-                texts=texts,
-                labels=labels,
-                tokenizer=self.tokenizer
+            tokenizer, model = self._load_artifact(registry.version_path(base_version))
+            new_input_ids = tokenizer(
+                [str(query) for _, query, _ in rows],
+                add_special_tokens=True,
+                max_length=MAX_SEQ_LEN,
+                truncation=True,
+                return_token_type_ids=False,
+                return_attention_mask=False,
+            )['input_ids']
+            replay_input_ids, replay_labels = replay_sample(
+                load_tokenized_dataset(train_file, tokenizer, max_len=MAX_SEQ_LEN, label2idx=self.label2idx),
+                int(len(rows) * INCREMENTAL_REPLAY_RATIO),
             )
-            
-            # Training arguments
-            training_args = TrainingArguments(
-                output_dir='./data4c/results',
-                num_train_epochs=5,
-                per_device_train_batch_size=16,
-                warmup_steps=500,
-                weight_decay=0.01,
-                logging_dir='./data4c/logs',
-                logging_steps=10,
-                save_steps=10000,
-                save_total_limit=2,
+            train_dataset = ExampleDataset(
+                new_input_ids + replay_input_ids,
+                [label for _, _, label in rows] + replay_labels,
             )
-
-            # Initialize trainer
-            trainer = Trainer(
-                model=self.model,
-                args=training_args,
-                train_dataset=train_dataset,
+            logger.info(
+                f"Training on {len(rows)} new examples (issues up to id {high_water_mark}) "
+                f"and {len(replay_labels)} replayed from {train_file}"
+            )
+            result = self._fit(
+                tokenizer,
+                model,
+                train_dataset,
+                num_train_epochs=INCREMENTAL_EPOCHS,
+                learning_rate=INCREMENTAL_LEARNING_RATE,
+                warmup_steps=0,
+                warmup_ratio=0.1,
+            )
+            # The first tier is cheap enough to refit on all of the data
+            texts, labels = cascade.read_training_examples(train_file, self.label2idx)
+            first_tier = cascade.FirstTier.fit(
+                texts + [str(query) for _, query, _ in rows],
+                labels + [label for _, _, label in rows],
+                len(self.products),
             )
-
-            logger.info("Starting training...")
-            trainer.train()
-            
-            # Save the model
-            model_save_path = './data4c/results/model_distill_bert.pth'
-            torch.save(self.model.state_dict(), model_save_path)
-            logger.info(f"Model saved to {model_save_path}")
-            
-            # Test the model on sample queries
-            logger.info("\nTesting model on sample queries:")
-            test_queries = [
-                "How do I connect my printer to WiFi?",
-                "The scanner is not working",
-                "Laptop battery not charging",
-                "Monitor display is blank"
-            ]
-            for query in test_queries:
-                code, name = self.classify(query)
-                logger.info(f"Query: {query}")
-                logger.info(f"Predicted: {name} (code: {code})\n")
             
-            return True
+            return self._publish(tokenizer, model, activate=activate, first_tier=first_tier, metadata={
+                'mode': 'incremental',
+                'base_version': base_version,
+                'train_file': os.path.abspath(train_file),
+                'examples': len(train_dataset),
+                'new_examples': len(rows),
+                'replay_examples': len(replay_labels),
+                'issue_high_water_mark': high_water_mark,
+                'corrections_cutoff': cutoff.isoformat(),
+                'training_loss': result.training_loss,
+            })
             
         except Exception as e:
-            logger.error(f"Error during training: {str(e)}", exc_info=True)
-            return False
+            logger.error(f"Error during incremental training: {str(e)}", exc_info=True)
+            return None
 
     def classify(self, query):
         """
-        Classify a customer query and return product code and name.
+        Classify a customer query and return its ClassificationResult
+        (product code and name, confidence and top-k alternatives).
         """
-        logger.info(f"Classifying query: {query}")
-        
-        # Ensure model is in eval mode
-        self.model.eval()
-        
-        # Tokenize input
-        inputs = self.tokenizer(
-            query,
-            truncation=True,
-            padding="max_length",
-            max_length=256,
-            return_tensors="pt"
-        )
+        logger.debug(f"Classifying query: {query}")
+        return self.classify_batch([query])[0]
+
+    def classify_batch(self, queries):
+        """
+        Classify a list of customer queries in a single forward pass.
+        Returns a list of ClassificationResult in input order.
+        """
+        results, timings = self.classify_batch_timed(queries)
+        observe_batch(results, timings)
+        return results
+
+    def classify_batch_timed(self, queries):
+        """classify_batch that also returns the seconds spent in each stage that ran"""
+        timings = {}
+        if not queries:
+            return [], timings
+        # Hold on to one version for the whole batch, even if a swap happens meanwhile
+        runtime = self.runtime
+        if runtime is None:
+            raise ModelNotReadyError("No trained model is loaded yet")
         
-        # Move input tensors to device
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        results = [None] * len(queries)
+        pending = list(range(len(queries)))
+        if runtime.first_tier is not None:
+            # Cascade: keep the first tier's confident answers, run DistilBERT on the rest
+            start = time.perf_counter()
+            probs = runtime.first_tier.predict_proba(queries)
+            confident = probs.max(axis=1) >= self.cascade_threshold
+            answered = np.flatnonzero(confident).tolist()
+            if answered:
+                first_tier_results = self._postprocess(torch.from_numpy(probs[confident]), tier='first_tier')
+                for i, result in zip(answered, first_tier_results):
+                    results[i] = result
+            pending = np.flatnonzero(~confident).tolist()
+            timings['first_tier'] = time.perf_counter() - start
         
-        # Get prediction
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            
-        # Get probabilities
-        probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
+        if pending:
+            timings.update(tokenize=0.0, forward=0.0, postprocess=0.0)
+            logits, embeddings = self._transformer_forward(
+                runtime, [queries[i] for i in pending], timings, embed=self.embeddings_enabled
+            )
+            start = time.perf_counter()
+            transformer_results = self._postprocess(
+                torch.softmax(logits, dim=-1), embeddings=embeddings, model_version=runtime.version
+            )
+            for i, result in zip(pending, transformer_results):
+                results[i] = result
+            timings['postprocess'] += time.perf_counter() - start
         
-        # Get top prediction
-        product_code = torch.argmax(outputs.logits).item()
-        product_name = self.idx2label[product_code]
+        # Log classification details (per-query debug detail, skipped unless enabled)
+        if logger.isEnabledFor(logging.DEBUG):
+            for query, result in zip(queries, results):
+                top = ", ".join(f"{name}: {prob:.3f}" for _, name, prob in result.top_k)
+                logger.debug(
+                    f"Classified '{query}' as {result.product_name} (code: {result.product_code}, "
+                    f"{result.tier}); top {len(result.top_k)}: {top}"
+                )
         
-        # Log classification details
-        logger.info(f"Classification details for: '{query}'")
-        logger.info(f"Predicted class: {product_name} (code: {product_code})")
-        logger.info("Top 3 predictions:")
-        top_probs, top_indices = torch.topk(probs, min(3, len(self.products)))
-        for prob, idx in zip(top_probs[0], top_indices[0]):
-            logger.info(f"{self.idx2label[idx.item()]}: {prob.item():.3f}")
+        return results, timings
+
+    def embed_batch(self, queries):
+        """
+        (model_version, embeddings) for queries without classifying them:
+        a (len(queries), hidden size) float16 array of L2-normalized
+        sentence embeddings, e.g. to index issues logged without one
+        """
+        runtime = self.runtime
+        if runtime is None:
+            raise ModelNotReadyError("No trained model is loaded yet")
+        timings = {'tokenize': 0.0, 'forward': 0.0}
+        _, embeddings = self._transformer_forward(runtime, queries, timings, embed=True)
+        return runtime.version, vector_index.normalize(embeddings.numpy()).astype(np.float16)
+
+    def _transformer_forward(self, runtime, queries, timings, embed=False):
+        """
+        (len(queries), labels) DistilBERT logits and, with embed, the
+        (len(queries), hidden size) sentence embeddings of the same pass
+        (else None), adding to the tokenize / forward timings
+        """
+        # Tokenize without padding, then pad each length bucket to its own
+        # longest sequence instead of always padding to MAX_SEQ_LEN
+        start = time.perf_counter()
+        input_ids = runtime.tokenizer(
+            [str(query) for query in queries],
+            truncation=True,
+            max_length=MAX_SEQ_LEN,
+            return_token_type_ids=False,
+            return_attention_mask=False,
+        )['input_ids']
+        timings['tokenize'] += time.perf_counter() - start
         
-        return product_code, product_name
+        logits = torch.empty(len(queries), len(self.products))
+        embeddings = None
+        for bucket in length_buckets([len(ids) for ids in input_ids]):
+            start = time.perf_counter()
+            inputs = runtime.tokenizer.pad(
+                {'input_ids': [input_ids[i] for i in bucket]},
+                padding='longest',
+                return_tensors='pt'
+            )
+            timings['tokenize'] += time.perf_counter() - start
+            
+            # Get prediction
+            start = time.perf_counter()
+            bucket_logits, bucket_embeddings = runtime.backend.forward(
+                inputs['input_ids'], inputs['attention_mask'], embed=embed
+            )
+            logits[bucket] = bucket_logits
+            if bucket_embeddings is not None:
+                if embeddings is None:
+                    embeddings = torch.empty(len(queries), bucket_embeddings.shape[-1])
+                embeddings[bucket] = bucket_embeddings
+            timings['forward'] += time.perf_counter() - start
+        return logits, embeddings
+
+    def _postprocess(self, probs, tier='transformer', embeddings=None, model_version=None):
+        """
+        ClassificationResults for a (batch, labels) probability tensor. Top-k
+        runs once for the whole batch, and probabilities and indices come
+        back to Python in a single tolist(). Each result gets its row of
+        embeddings (normalized to float16 once for the batch), if given.
+        """
+        k = max(1, min(TOP_K, probs.shape[-1]))
+        top_probs, top_indices = torch.topk(probs.float(), k, dim=-1)
+        # Indices are < number of labels, so they are exact as floats
+        rows = torch.cat([top_probs, top_indices.to(top_probs.dtype)], dim=-1).tolist()
+        if embeddings is not None:
+            embeddings = vector_index.normalize(embeddings.numpy()).astype(np.float16)
+        products = self.products
+        results = []
+        for i, row in enumerate(rows):
+            top_k = tuple(
+                (int(idx), products[int(idx)], prob) for prob, idx in zip(row[:k], row[k:])
+            )
+            code, name, confidence = top_k[0]
+            results.append(ClassificationResult(
+                code, name, confidence, top_k, tier,
+                embedding=embeddings[i] if embeddings is not None else None,
+                model_version=model_version
+            ))
+        return results
 
 # Training usage example
 if __name__ == "__main__":
@@ -244,7 +670,7 @@ if __name__ == "__main__":
             "Monitor keeps flickering"
         ]
         for query in test_queries:
-            product_code, product_name = classifier.classify(query)
+            result = classifier.classify(query)
             logger.info(f"\nTest Query: {query}")
-            logger.info(f"Predicted Product: {product_name}")
-            logger.info(f"Product Code: {product_code}")
+            logger.info(f"Predicted Product: {result.product_name}")
+            logger.info(f"Product Code: {result.product_code} (confidence: {result.confidence:.3f})")
@@ -0,0 +1,85 @@
+"""
+Accuracy-parity check for the optimized inference backends.
+
+Runs every query in the training CSV through the fp32 eager model and through
+the candidate backend, then reports how often the two agree and how accurate
+each one is against the labelled product.
+
+Usage:
+    python -m app.classification.parity --backend int8
+    python -m app.classification.parity --backend onnx --min-agreement 0.995
+"""
+import argparse
+import sys
+import time
+import pandas as pd
+from .issue_classification import IssueClassifier
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _predict(classifier, queries, batch_size):
+    codes = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        codes.extend(result.product_code for result in classifier.classify_batch(queries[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return codes, elapsed
+
+
+def check_parity(backend, data_file='data4c/customer_queries.csv', batch_size=32):
+    """Compare a backend's predictions with the fp32 eager model on data_file"""
+    df = pd.read_csv(data_file)
+    queries = [str(query) for query in df['Query'].tolist()]
+
+    # Transformer only: the cascade first tier would answer the same way for both
+    reference = IssueClassifier(backend='eager', cascade_enabled=False)
+    candidate = IssueClassifier(backend=backend, cascade_enabled=False)
+    labels = df['Product'].map(reference.label2idx).tolist()
+
+    ref_codes, ref_time = _predict(reference, queries, batch_size)
+    cand_codes, cand_time = _predict(candidate, queries, batch_size)
+
+    total = len(queries)
+    agree = sum(r == c for r, c in zip(ref_codes, cand_codes))
+    report = {
+        'backend': candidate.backend.name,
+        'examples': total,
+        'agreement': agree / total if total else 1.0,
+        'fp32_accuracy': sum(r == l for r, l in zip(ref_codes, labels)) / total if total else 0.0,
+        'backend_accuracy': sum(c == l for c, l in zip(cand_codes, labels)) / total if total else 0.0,
+        'fp32_ms_per_query': ref_time * 1000 / max(total, 1),
+        'backend_ms_per_query': cand_time * 1000 / max(total, 1),
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a classifier backend against fp32")
+    parser.add_argument('--backend', default='int8', choices=['eager', 'int8', 'onnx'])
+    parser.add_argument('--data', default='data4c/customer_queries.csv')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help="exit non-zero if agreement with fp32 falls below this")
+    args = parser.parse_args(argv)
+
+    report = check_parity(args.backend, args.data, args.batch_size)
+    if report['backend'] != args.backend:
+        # e.g. the current version was published without an ONNX export
+        logger.error(f"The current version cannot be served with the {args.backend} backend")
+        return 1
+    for key, value in report.items():
+        logger.info(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+    if report['agreement'] < args.min_agreement:
+        logger.error(
+            f"{report['backend']} agrees with fp32 on only {report['agreement']:.2%} "
+            f"of examples (required {args.min_agreement:.2%})"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from .issue_classification import observe_batch
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Number of inference worker processes; 0 keeps inference in the API process
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '0'))
+# Torch intra-op threads per worker; 0 splits the machine's cores evenly
+TORCH_THREADS_PER_WORKER = int(os.getenv('TORCH_THREADS_PER_WORKER', '0'))
+
+# Set in the parent right before the workers are forked, so every worker
+# inherits the already loaded weights copy-on-write instead of loading its own
+_classifier = None
+
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed by the parent; intra-op threads are what matter here
+        pass
+    # Native thread pools (ONNX Runtime) do not survive fork; rebuild them here
+    reload = getattr(_classifier.backend, 'reload', None)
+    if reload is not None:
+        reload(num_threads)
+    # Thread pools and allocator caches start cold after fork
+    _classifier.warmup()
+
+
+def _classify_batch(queries):
+    # Timings travel back with the results; metrics are only served by the parent
+    return _classifier.classify_batch_timed(queries)
+
+
+class InferencePool:
+    """
+    Serves classify_batch from a pool of forked worker processes.
+
+    Weights are loaded once in the parent and shared with the workers
+    copy-on-write; inference never writes to them, so the pages stay shared
+    and adding workers does not multiply RSS. Each worker is limited to its
+    share of the machine's cores so the workers don't oversubscribe the CPU.
+
+    Exposes the same classify_batch / model_version / is_trained surface as
+    IssueClassifier so it can sit behind ClassificationBatcher unchanged.
+    After the classifier swaps to a new model version, restart() forks a
+    fresh set of workers from it while the old set drains.
+    """
+
+    def __init__(self, classifier, workers=INFERENCE_WORKERS, threads_per_worker=TORCH_THREADS_PER_WORKER):
+        self.classifier = classifier
+        self.workers = max(1, int(workers))
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+        self._executor = None
+        # Version the running workers were forked with
+        self.model_version = 'untrained'
+        self.is_trained = False
+        self._restart_lock = threading.Lock()
+
+    def _fork_workers(self):
+        global _classifier
+        _classifier = self.classifier
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,),
+        )
+        # Fork every worker now rather than lazily on the first requests
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def start(self):
+        """Fork the worker processes from the current classifier state"""
+        if self._executor is not None:
+            return
+        self.model_version = self.classifier.model_version
+        self.is_trained = self.classifier.is_trained
+        self._executor = self._fork_workers()
+        logger.info(
+            f"Inference pool started with {self.workers} workers "
+            f"x {self.threads_per_worker} torch threads (model {self.model_version})"
+        )
+
+    def restart(self):
+        """
+        Fork new workers from the classifier's current model and retire the
+        old ones once their in-flight batches finish
+        """
+        with self._restart_lock:
+            if self._executor is None:
+                return
+            version = self.classifier.model_version
+            is_trained = self.classifier.is_trained
+            executor = self._fork_workers()
+            old_executor, self._executor = self._executor, executor
+            self.model_version, self.is_trained = version, is_trained
+        threading.Thread(target=old_executor.shutdown, name="inference-pool-drain", daemon=True).start()
+        logger.info(f"Inference pool restarted with model {version}")
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        logger.info("Inference pool stopped")
+
+    def classify_batch(self, queries):
+        """Run one batch on a worker process; blocks the calling thread"""
+        executor = self._executor
+        if executor is None:
+            raise RuntimeError("Inference pool is not running")
+        try:
+            future = executor.submit(_classify_batch, queries)
+        except RuntimeError:
+            # Raced with restart() retiring this executor; use the new one
+            if self._executor is None or self._executor is executor:
+                raise
+            future = self._executor.submit(_classify_batch, queries)
+        results, timings = future.result()
+        observe_batch(results, timings)
+        return results
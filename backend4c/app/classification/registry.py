@@ -0,0 +1,127 @@
+"""
+Versioned model artifacts.
+
+Every training run writes a complete artifact to its own directory under
+MODEL_VERSIONS_PATH; versions are never modified once published. The
+CURRENT file names the version that should be served and is replaced
+atomically, so a reader sees either the old version or the new one.
+"""
+import json
+import os
+import shutil
+from datetime import datetime
+from ..database import MODEL_ARTIFACT_PATH, MODEL_CURRENT_PATH, MODEL_VERSIONS_PATH
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Published versions kept on disk (the current one is always kept)
+MODEL_KEEP_VERSIONS = int(os.getenv('MODEL_KEEP_VERSIONS', '3'))
+
+METADATA_FILENAME = 'version.json'
+
+
+def is_model_artifact(path):
+    """True if path holds a self-contained model (safetensors + config + tokenizer)"""
+    return all(
+        os.path.isfile(os.path.join(path, name))
+        for name in ('config.json', 'model.safetensors', 'tokenizer.json')
+    )
+
+
+def version_path(version, versions_dir=MODEL_VERSIONS_PATH):
+    return os.path.join(versions_dir, version)
+
+
+def new_version(versions_dir=MODEL_VERSIONS_PATH):
+    """Unused, time-ordered version name"""
+    base = datetime.now().strftime('%Y%m%d_%H%M%S')
+    version, suffix = base, 1
+    while os.path.exists(version_path(version, versions_dir)) or \
+            os.path.exists(version_path(f"{version}.tmp", versions_dir)):
+        suffix += 1
+        version = f"{base}_{suffix}"
+    return version
+
+
+def list_versions(versions_dir=MODEL_VERSIONS_PATH):
+    """Published versions, oldest first"""
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(versions_dir)
+        if not name.endswith('.tmp') and is_model_artifact(os.path.join(versions_dir, name))
+    )
+
+
+def current_version(current_path=MODEL_CURRENT_PATH, versions_dir=MODEL_VERSIONS_PATH):
+    """Version CURRENT points at, or None if there is no usable one"""
+    try:
+        with open(current_path, encoding='utf-8') as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if not version or not is_model_artifact(version_path(version, versions_dir)):
+        logger.warning(f"{current_path} points at missing model version '{version}'")
+        return None
+    return version
+
+
+def set_current_version(version, current_path=MODEL_CURRENT_PATH, versions_dir=MODEL_VERSIONS_PATH):
+    """Point CURRENT at a published version"""
+    if not is_model_artifact(version_path(version, versions_dir)):
+        raise ValueError(f"Unknown model version: {version}")
+    tmp_path = f"{current_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+    logger.info(f"Current model version set to {version}")
+
+
+def read_metadata(version, versions_dir=MODEL_VERSIONS_PATH):
+    try:
+        with open(os.path.join(version_path(version, versions_dir), METADATA_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_metadata(path, metadata):
+    """Store training details alongside an artifact (before it is published)"""
+    with open(os.path.join(path, METADATA_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, indent=2, default=str)
+
+
+def publish(tmp_path, version, versions_dir=MODEL_VERSIONS_PATH):
+    """Move a fully written artifact directory into place as version"""
+    path = version_path(version, versions_dir)
+    os.replace(tmp_path, path)
+    logger.info(f"Model version {version} published to {path}")
+    return path
+
+
+def prune_versions(keep=MODEL_KEEP_VERSIONS, versions_dir=MODEL_VERSIONS_PATH, current_path=MODEL_CURRENT_PATH):
+    """Delete the oldest versions beyond keep, never the current one"""
+    current = current_version(current_path, versions_dir)
+    old_versions = [v for v in list_versions(versions_dir) if v != current]
+    excess = len(old_versions) - max(0, keep - (1 if current else 0))
+    for version in old_versions[:max(0, excess)]:
+        shutil.rmtree(version_path(version, versions_dir), ignore_errors=True)
+        logger.info(f"Removed old model version {version}")
+
+
+def migrate_legacy_artifact(legacy_path=MODEL_ARTIFACT_PATH, versions_dir=MODEL_VERSIONS_PATH,
+                            current_path=MODEL_CURRENT_PATH):
+    """Adopt an unversioned model_distill_bert/ artifact as the first version"""
+    if not is_model_artifact(legacy_path):
+        return None
+    os.makedirs(versions_dir, exist_ok=True)
+    mtime = os.path.getmtime(os.path.join(legacy_path, 'model.safetensors'))
+    version = datetime.fromtimestamp(mtime).strftime('%Y%m%d_%H%M%S')
+    if not os.path.exists(version_path(version, versions_dir)):
+        shutil.move(legacy_path, version_path(version, versions_dir))
+    logger.info(f"Migrated model artifact {legacy_path} to version {version}")
+    set_current_version(version, current_path, versions_dir)
+    return version
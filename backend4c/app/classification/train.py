@@ -0,0 +1,47 @@
+"""
+Train and publish a new model version.
+
+Runs the fine-tune in its own process so the API keeps serving meanwhile.
+--incremental continues from the current version on issues logged (and
+corrected) since it was trained, instead of starting from the base model.
+The result is written to MODEL_VERSIONS_PATH/<version>, and unless
+--no-activate is given, CURRENT is pointed at it. Running API processes
+then swap to it without a restart.
+
+Usage:
+    python -m app.classification.train
+    python -m app.classification.train --data data4c/customer_queries.csv --no-activate
+    python -m app.classification.train --incremental
+"""
+import argparse
+import sys
+from .issue_classification import IssueClassifier
+from ..database import TRAINING_DATA_PATH
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and publish a new classifier version")
+    parser.add_argument('--data', default=TRAINING_DATA_PATH, help="training CSV (Query, Product columns)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="continue from the current version on newly logged issues plus a replay sample")
+    parser.add_argument('--no-activate', dest='activate', action='store_false',
+                        help="publish the version without making it current")
+    args = parser.parse_args(argv)
+
+    classifier = IssueClassifier(load=False)
+    if args.incremental:
+        version = classifier.train_incremental(args.data, activate=args.activate)
+    else:
+        version = classifier.train(args.data, activate=args.activate)
+    if version is None:
+        logger.error("Training failed")
+        return 1
+    logger.info(f"Trained model version {version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
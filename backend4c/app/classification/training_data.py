@@ -0,0 +1,223 @@
+"""
+Pre-tokenized training data.
+
+The training CSV is tokenized once, in large batches with the fast (Rust)
+tokenizer, and the result is stored as flat NumPy arrays:
+
+    input_ids.npy  every example's token ids back to back (uint16 when the
+                   vocabulary fits, else int32)
+    offsets.npy    start of each example in input_ids (len = examples + 1)
+    labels.npy     class index per example
+
+The cache directory is keyed by a hash of the CSV contents, the tokenizer
+definition, MAX_SEQ_LEN and the label mapping, so any change to those
+produces a fresh cache and a stale one is never read. Each cache also
+records the CSV it was built from (source.json); building a new one only
+removes older caches of the same CSV. Arrays are opened
+with mmap, so DataLoader workers share the pages instead of each holding a
+copy.
+"""
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from torch.utils.data import Dataset
+from transformers import Trainer
+from transformers.trainer_pt_utils import LengthGroupedSampler
+from ..database import TOKENIZED_CACHE_DIRECTORY
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Rows read from the CSV and tokenized per batch when building the cache
+TOKENIZE_CHUNK_SIZE = int(os.getenv('TOKENIZE_CHUNK_SIZE', '10000'))
+
+CACHE_FILES = ('input_ids.npy', 'offsets.npy', 'labels.npy')
+SOURCE_FILENAME = 'source.json'
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash that changes whenever the tokenizer would produce different ids"""
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is None:
+        raise TypeError("A fast tokenizer is required to build the tokenized cache")
+    definition = json.loads(backend.to_str())
+    # Per-call truncation/padding state, not part of the vocabulary or rules
+    definition.pop('truncation', None)
+    definition.pop('padding', None)
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_key(train_file, tokenizer, max_len, label2idx):
+    key = {
+        'data': file_digest(train_file),
+        'tokenizer': tokenizer_fingerprint(tokenizer),
+        'max_len': max_len,
+        'labels': sorted(label2idx.items(), key=lambda item: item[1]),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+class TokenizedDataset(Dataset):
+    """
+    Training examples backed by the memory-mapped cache arrays. Items are
+    unpadded; DataCollatorWithPadding pads each batch to its longest member.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.input_ids = np.load(os.path.join(path, 'input_ids.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return {
+            'input_ids': self.input_ids[start:end].tolist(),
+            'labels': int(self.labels[idx]),
+        }
+
+    def lengths(self):
+        """Token count of every example (what group_by_length sorts on)"""
+        return np.diff(self.offsets).tolist()
+
+    def label_counts(self):
+        return np.bincount(self.labels)
+
+
+class ExampleDataset(Dataset):
+    """Small in-memory set of tokenized examples (incremental retraining)"""
+    def __init__(self, input_ids, labels):
+        self.input_ids = list(input_ids)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return {'input_ids': self.input_ids[idx], 'labels': int(self.labels[idx])}
+
+    def lengths(self):
+        return [len(ids) for ids in self.input_ids]
+
+    def label_counts(self):
+        return np.bincount(self.labels)
+
+
+def replay_sample(dataset, size, seed=None):
+    """Random subset of a TokenizedDataset as (input_ids, labels) lists"""
+    size = min(size, len(dataset))
+    indices = np.random.default_rng(seed).choice(len(dataset), size=size, replace=False)
+    examples = [dataset[int(i)] for i in np.sort(indices)]
+    return [example['input_ids'] for example in examples], [example['labels'] for example in examples]
+
+
+def _build_cache(train_file, tokenizer, max_len, label2idx, path):
+    """Tokenize train_file chunk by chunk and write the cache arrays to path"""
+    id_dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.int32
+    label_dtype = np.int16 if len(label2idx) <= np.iinfo(np.int16).max else np.int32
+    id_chunks, length_chunks, label_chunks = [], [], []
+
+    for chunk in pd.read_csv(train_file, usecols=['Query', 'Product'], chunksize=TOKENIZE_CHUNK_SIZE):
+        labels = chunk['Product'].map(label2idx)
+        if labels.isna().any():
+            invalid_products = chunk['Product'][labels.isna()].unique()
+            logger.error(f"Found invalid product names: {invalid_products}")
+            raise ValueError(f"Invalid product names found: {invalid_products}")
+
+        encodings = tokenizer(
+            chunk['Query'].fillna('').astype(str).tolist(),
+            add_special_tokens=True,
+            max_length=max_len,
+            truncation=True,
+            return_token_type_ids=False,
+            return_attention_mask=False,
+        )['input_ids']
+        length_chunks.append(np.fromiter((len(ids) for ids in encodings), dtype=np.int64, count=len(encodings)))
+        id_chunks.append(np.fromiter(
+            (token for ids in encodings for token in ids), dtype=id_dtype, count=int(length_chunks[-1].sum())
+        ))
+        label_chunks.append(labels.to_numpy(dtype=label_dtype))
+
+    lengths = np.concatenate(length_chunks) if length_chunks else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'input_ids.npy'),
+            np.concatenate(id_chunks) if id_chunks else np.zeros(0, dtype=id_dtype))
+    np.save(os.path.join(tmp_path, 'offsets.npy'), offsets)
+    np.save(os.path.join(tmp_path, 'labels.npy'),
+            np.concatenate(label_chunks) if label_chunks else np.zeros(0, dtype=label_dtype))
+    source = os.path.abspath(train_file)
+    with open(os.path.join(tmp_path, SOURCE_FILENAME), 'w') as f:
+        json.dump({'train_file': source}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    _prune_stale_caches(os.path.dirname(path), source, keep=path)
+
+
+def _prune_stale_caches(cache_dir, source, keep):
+    """
+    Remove the caches of older versions of the source CSV, which are never
+    read again. Caches of other CSVs are left alone: a concurrent training
+    run may have them mmapped.
+    """
+    for name in os.listdir(cache_dir):
+        stale = os.path.join(cache_dir, name)
+        if stale == keep or name.endswith('.tmp') or not os.path.isdir(stale):
+            continue
+        try:
+            with open(os.path.join(stale, SOURCE_FILENAME)) as f:
+                stale_source = json.load(f).get('train_file')
+        except (OSError, ValueError):
+            # Unknown origin (e.g. built before source.json existed)
+            continue
+        if stale_source == source:
+            shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_tokenized_dataset(train_file, tokenizer, max_len, label2idx, cache_dir=TOKENIZED_CACHE_DIRECTORY):
+    """
+    TokenizedDataset for train_file, building the cache on first use.
+    Subsequent runs over an unchanged CSV skip reading and tokenizing it.
+    """
+    path = os.path.join(cache_dir, cache_key(train_file, tokenizer, max_len, label2idx))
+    if all(os.path.isfile(os.path.join(path, name)) for name in CACHE_FILES):
+        logger.info(f"Using tokenized training data cache {path}")
+    else:
+        logger.info(f"Tokenizing {train_file} into {path}")
+        os.makedirs(cache_dir, exist_ok=True)
+        _build_cache(train_file, tokenizer, max_len, label2idx, path)
+    dataset = TokenizedDataset(path)
+    logger.info(f"Loaded {len(dataset)} tokenized training examples ({len(dataset.input_ids)} tokens)")
+    return dataset
+
+
+class TokenizedTrainer(Trainer):
+    """
+    Trainer that takes group_by_length lengths straight from the dataset
+    (the offsets array) instead of fetching every example once to measure it.
+    """
+    def _get_train_sampler(self, *args, **kwargs):
+        if self.args.group_by_length and isinstance(self.train_dataset, (TokenizedDataset, ExampleDataset)):
+            return LengthGroupedSampler(
+                self.args.train_batch_size * self.args.gradient_accumulation_steps,
+                lengths=self.train_dataset.lengths(),
+            )
+        return super()._get_train_sampler(*args, **kwargs)
@@ -0,0 +1,277 @@
+"""
+Memory-mapped vector index of issue embeddings.
+
+Vectors are L2-normalized (so cosine similarity is a dot product) and kept
+as one contiguous row-major matrix on disk next to the issue ids they
+belong to. Appends go to the end of the files under a cross-process file
+lock; readers map the files read-only and remap whenever they have grown,
+so every process serving searches shares the same page cache.
+
+Search is exact by default: a matrix-vector product over the whole matrix
+in chunks and a partial sort for the top k. For large indexes, train_ivf()
+clusters the vectors (spherical k-means) and search then only scores the
+rows of the nprobe clusters closest to the query.
+"""
+import json
+import os
+import threading
+import numpy as np
+from filelock import FileLock
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Embed every DistilBERT forward pass and index logged issues for similar-issue search
+SIMILAR_ISSUES_ENABLED = os.getenv('SIMILAR_ISSUES', 'false').lower() in ('1', 'true', 'yes')
+# On-disk precision of new indexes: float16 halves the size, float32 skips the conversion on search
+VECTOR_INDEX_DTYPE = os.getenv('VECTOR_INDEX_DTYPE', 'float16')
+# IVF clusters scored per search once the index has been clustered
+VECTOR_INDEX_NPROBE = int(os.getenv('VECTOR_INDEX_NPROBE', '8'))
+# Rows converted and scored at a time, bounding the float32 working set
+SEARCH_CHUNK_ROWS = 16384
+
+META_FILENAME = 'meta.json'
+VECTORS_FILENAME = 'vectors.bin'
+IDS_FILENAME = 'ids.bin'
+LISTS_FILENAME = 'lists.bin'
+CENTROIDS_FILENAME = 'centroids.npy'
+LOCK_FILENAME = 'index.lock'
+
+ID_DTYPE = np.dtype(np.int64)
+LIST_DTYPE = np.dtype(np.int32)
+
+
+def normalize(vectors):
+    """float32 copy of vectors with every row scaled to unit length"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """
+    Append-only (id, vector) index in a directory:
+
+        meta.json      dim and dtype
+        vectors.bin    N x dim matrix
+        ids.bin        N int64 ids, row for row
+        lists.bin      N int32 IVF cluster per row (after train_ivf)
+        centroids.npy  IVF centroids (after train_ivf)
+
+    ids.bin is always written last, so its length is the number of
+    complete rows. An id appended twice is only returned once by search.
+    """
+
+    def __init__(self, path, dtype=VECTOR_INDEX_DTYPE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(path, LOCK_FILENAME))
+        self._lock = threading.Lock()
+        self._count = 0
+        self._vectors = None
+        self._ids = np.empty(0, dtype=ID_DTYPE)
+        self._lists = None
+        self._centroids = None
+        self._centroids_mtime = None
+        # The dimension is fixed by the first vectors added (by any process)
+        self.dim = None
+        self.dtype = np.dtype(dtype)
+        self._load_meta()
+
+    def _load_meta(self):
+        meta_path = self._file(META_FILENAME)
+        if self.dim is not None or not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.dtype = np.dtype(meta['dtype'])
+        self._row_bytes = meta['dim'] * self.dtype.itemsize
+        self._vectors = np.empty((0, meta['dim']), dtype=self.dtype)
+        self.dim = meta['dim']
+
+    def _write_meta(self, dim):
+        meta_path = self._file(META_FILENAME)
+        tmp_path = f"{meta_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': int(dim), 'dtype': self.dtype.name}, f)
+        os.replace(tmp_path, meta_path)
+        self._load_meta()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _size(self, name):
+        try:
+            return os.path.getsize(self._file(name))
+        except FileNotFoundError:
+            return 0
+
+    def _map(self, name, dtype, shape):
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=shape)
+
+    def _refresh(self):
+        """Remap the files if another append (from any process) made them grow"""
+        self._load_meta()
+        if self.dim is None:
+            return
+        count = min(self._size(IDS_FILENAME) // ID_DTYPE.itemsize, self._size(VECTORS_FILENAME) // self._row_bytes)
+        centroids_path = self._file(CENTROIDS_FILENAME)
+        centroids_mtime = os.path.getmtime(centroids_path) if os.path.exists(centroids_path) else None
+        if count == self._count and centroids_mtime == self._centroids_mtime:
+            return
+        with self._lock:
+            if centroids_mtime != self._centroids_mtime:
+                self._centroids = np.load(centroids_path) if centroids_mtime is not None else None
+                self._centroids_mtime = centroids_mtime
+            if count:
+                self._vectors = self._map(VECTORS_FILENAME, self.dtype, (count, self.dim))
+                self._ids = self._map(IDS_FILENAME, ID_DTYPE, (count,))
+            has_lists = self._centroids is not None and self._size(LISTS_FILENAME) >= count * LIST_DTYPE.itemsize
+            self._lists = self._map(LISTS_FILENAME, LIST_DTYPE, (count,)) if has_lists and count else None
+            self._count = count
+
+    def __len__(self):
+        self._refresh()
+        return self._count
+
+    def ids(self):
+        """Every indexed id, in append order"""
+        self._refresh()
+        return np.array(self._ids[:self._count])
+
+    @property
+    def nlist(self):
+        """Number of IVF clusters; 0 while the index is searched exhaustively"""
+        self._refresh()
+        return 0 if self._centroids is None else len(self._centroids)
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(LIST_DTYPE)
+
+    def add(self, ids, vectors):
+        """Append vectors (normalized here) for ids"""
+        ids = np.asarray(ids, dtype=ID_DTYPE).reshape(-1)
+        vectors = normalize(vectors)
+        if not len(ids):
+            return
+        with self._file_lock:
+            self._refresh()
+            if self.dim is None:
+                self._write_meta(vectors.shape[1])
+            if len(ids) != len(vectors) or vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {len(ids)} vectors of dimension {self.dim}, got {vectors.shape}")
+            count = self._count
+            # Drop any partial row left behind by an append that died midway
+            for name, row_bytes in ((VECTORS_FILENAME, self._row_bytes), (LISTS_FILENAME, LIST_DTYPE.itemsize)):
+                if self._size(name) > count * row_bytes:
+                    os.truncate(self._file(name), count * row_bytes)
+            with open(self._file(VECTORS_FILENAME), 'ab') as f:
+                f.write(vectors.astype(self.dtype).tobytes())
+            if self._lists is not None:
+                with open(self._file(LISTS_FILENAME), 'ab') as f:
+                    f.write(self._assign(vectors).tobytes())
+            with open(self._file(IDS_FILENAME), 'ab') as f:
+                f.write(ids.tobytes())
+        self._refresh()
+
+    def train_ivf(self, nlist, sample_size=100000, seed=0):
+        """
+        Cluster the indexed vectors into nlist lists (spherical k-means on a
+        sample) and assign every row; later appends are assigned as they
+        are added. Returns the number of lists.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        with self._file_lock:
+            self._refresh()
+            count = self._count
+            nlist = min(int(nlist), count)
+            if nlist < 1:
+                raise ValueError("Cannot cluster an empty index")
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(count, size=min(count, sample_size), replace=False))
+            kmeans = MiniBatchKMeans(n_clusters=nlist, n_init=3, batch_size=4096, random_state=seed)
+            kmeans.fit(np.asarray(self._vectors[sample], dtype=np.float32))
+            centroids = normalize(kmeans.cluster_centers_)
+
+            lists = np.empty(count, dtype=LIST_DTYPE)
+            for start in range(0, count, SEARCH_CHUNK_ROWS):
+                block = np.asarray(self._vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+                lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            tmp_path = self._file(f"{LISTS_FILENAME}.tmp")
+            lists.tofile(tmp_path)
+            os.replace(tmp_path, self._file(LISTS_FILENAME))
+            tmp_path = self._file(f"{CENTROIDS_FILENAME}.tmp.npy")
+            np.save(tmp_path, centroids)
+            os.replace(tmp_path, self._file(CENTROIDS_FILENAME))
+        self._refresh()
+        logger.info(f"Clustered {count} vectors in {self.path} into {nlist} IVF lists")
+        return nlist
+
+    def _score(self, vectors, query, rows=None):
+        """Dot products of query with every row (or the given rows), chunk by chunk"""
+        total = self._count if rows is None else len(rows)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            end = min(total, start + SEARCH_CHUNK_ROWS)
+            block = vectors[start:end] if rows is None else vectors[rows[start:end]]
+            scores[start:end] = np.asarray(block, dtype=np.float32) @ query
+        return scores
+
+    def search(self, vector, k=10, allowed_ids=None, nprobe=VECTOR_INDEX_NPROBE):
+        """
+        The k (id, cosine similarity) pairs closest to vector, best first.
+        allowed_ids restricts the search to those ids; with IVF lists only
+        the nprobe closest clusters are scanned (nprobe=0 scans everything),
+        unless allowed_ids leaves fewer rows than that to score exactly.
+        """
+        self._refresh()
+        # One consistent view, even if an append remaps meanwhile
+        with self._lock:
+            count, vectors, ids, lists, centroids = (
+                self._count, self._vectors, self._ids, self._lists, self._centroids
+            )
+        if not count or k < 1:
+            return []
+        query = normalize(vector)[0]
+
+        rows = None
+        if allowed_ids is not None:
+            rows = np.flatnonzero(np.isin(ids[:count], np.asarray(list(allowed_ids), dtype=ID_DTYPE)))
+        # Probe IVF lists unless the allowed rows are fewer than a probe would scan anyway
+        if lists is not None and 0 < nprobe < len(centroids) and (
+            rows is None or len(rows) > count * nprobe / len(centroids)
+        ):
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            in_probe = np.isin(lists[:count], probe)
+            rows = np.flatnonzero(in_probe) if rows is None else rows[in_probe[rows]]
+        if rows is not None and not len(rows):
+            return []
+
+        scores = self._score(vectors, query, rows)
+        # Over-fetch a little so ids appended twice can be dropped
+        candidates = min(len(scores), 2 * k)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        top_rows = top if rows is None else rows[top]
+
+        results, seen = [], set()
+        for issue_id, score in zip(np.asarray(ids[top_rows]).tolist(), scores[top].tolist()):
+            if issue_id in seen:
+                continue
+            seen.add(issue_id)
+            results.append((issue_id, score))
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self):
+        self._refresh()
+        return {
+            "path": self.path,
+            "vectors": self._count,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "bytes": self._count * self.dim * self.dtype.itemsize if self.dim else 0,
+            "nlist": 0 if self._centroids is None else len(self._centroids),
+        }
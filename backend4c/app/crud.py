@@ -1,10 +1,16 @@
+import base64
+import json
+from sqlalchemy import column, func, literal_column, or_, table, tuple_
 from sqlalchemy.orm import Session
 from . import models
 from datetime import datetime
+from .utils import metrics
 from .utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+DB_WRITE_SECONDS = metrics.histogram('db_write_seconds', 'Issue write time by step', ['operation'])
+
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
@@ -31,9 +37,62 @@ def create_user(db: Session, email: str, password: str, is_active: bool = True,
     db.refresh(db_user)
     return db_user
 
+# Columns of a user as returned by list endpoints (never the password)
+USER_LIST_COLUMNS = (
+    models.User.id, models.User.email, models.User.full_name,
+    models.User.is_active, models.User.is_superuser,
+)
+# Columns of an issue as returned by list endpoints (the fields of IssueInDB)
+ISSUE_LIST_COLUMNS = (
+    models.Issue.id, models.Issue.query, models.Issue.response,
+    models.Issue.product_code, models.Issue.product_name, models.Issue.user_id,
+    models.Issue.created_at, models.Issue.corrected_product_code,
+)
+
+def get_users(db: Session):
+    """Every user as a row of USER_LIST_COLUMNS"""
+    return db.query(*USER_LIST_COLUMNS).order_by(models.User.id).all()
+
 def get_user_issues(db: Session, user_id: int):
     return db.query(models.Issue).filter(models.Issue.user_id == user_id).all()
 
+def encode_issue_cursor(issue):
+    """Opaque cursor pointing just past issue in newest-first order"""
+    raw = json.dumps([issue.created_at.isoformat(), issue.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_issue_cursor(cursor: str):
+    """Inverse of encode_issue_cursor; raises ValueError on a malformed cursor"""
+    try:
+        created_at, issue_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(issue_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_user_issues_page(db: Session, user_id: int, limit: int = 50, cursor: str = None):
+    """
+    One page of a user's issues, newest first, using keyset pagination on
+    (created_at, id) so every page is a range scan of ix_issues_user_created_id.
+    Returns (rows of ISSUE_LIST_COLUMNS, next_cursor); next_cursor is None on
+    the last page.
+    """
+    query = db.query(*ISSUE_LIST_COLUMNS).filter(models.Issue.user_id == user_id)
+    if cursor:
+        created_at, issue_id = decode_issue_cursor(cursor)
+        query = query.filter(
+            tuple_(models.Issue.created_at, models.Issue.id) < tuple_(created_at, issue_id)
+        )
+    issues = (
+        query.order_by(models.Issue.created_at.desc(), models.Issue.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(issues) > limit:
+        issues = issues[:limit]
+        next_cursor = encode_issue_cursor(issues[-1])
+    return issues, next_cursor
+
 def create_user_issue(
     db: Session, 
     issue: models.IssueCreate, 
@@ -55,6 +114,127 @@ def create_user_issue(
         created_at=current_time
     )
     db.add(db_issue)
-    db.commit()
-    db.refresh(db_issue)
-    return db_issue 
\ No newline at end of file
+    with DB_WRITE_SECONDS.time(operation="insert"):
+        db.flush()
+    with DB_WRITE_SECONDS.time(operation="commit"):
+        db.commit()
+    # No refresh: every column was set above and the id is known after the
+    # INSERT, so re-reading the row would only cost an extra SELECT
+    return db_issue
+
+def create_issues(db: Session, issues: list):
+    """
+    Insert many issues in a single transaction and return their ids.
+    Each item is a dict of Issue columns (query, user_id, product_code,
+    product_name, response and optionally created_at).
+    """
+    current_time = models.Issue.get_current_time()
+    db_issues = [
+        models.Issue(**{"created_at": current_time, **item})
+        for item in issues
+    ]
+    db.add_all(db_issues)
+    with DB_WRITE_SECONDS.time(operation="insert"):
+        db.flush()  # assigns primary keys
+    issue_ids = [db_issue.id for db_issue in db_issues]
+    with DB_WRITE_SECONDS.time(operation="commit"):
+        db.commit()
+    return issue_ids
+
+def create_user_issues(db: Session, user_id: int, issues: list):
+    """
+    Insert many classified issues for one user in a single transaction.
+    Each item is a dict with query, product_code, product_name and response.
+    """
+    issue_ids = create_issues(db, [{**item, "user_id": user_id} for item in issues])
+    logger.debug(f"Created {len(issue_ids)} issues for user {user_id} in one transaction")
+    return issue_ids
+
+def get_max_issue_id(db: Session):
+    return db.query(func.max(models.Issue.id)).scalar() or 0
+
+def get_training_issues(db: Session, corrected_after=None, corrected_until=None, after_id=None, up_to_id=None):
+    """
+    Labelled examples logged since the last model version, as (id, query,
+    product_code) rows in id order: issues corrected in (corrected_after,
+    corrected_until] (None leaves that end open), plus, when after_id is
+    given, every issue with after_id < id <= up_to_id labelled with its
+    prediction unless it was corrected.
+    """
+    condition = models.Issue.corrected_product_code.isnot(None)
+    if corrected_after is not None:
+        condition = condition & (models.Issue.corrected_at > corrected_after)
+    if corrected_until is not None:
+        condition = condition & (models.Issue.corrected_at <= corrected_until)
+    if after_id is not None:
+        logged = models.Issue.id > after_id
+        if up_to_id is not None:
+            logged = logged & (models.Issue.id <= up_to_id)
+        condition = or_(condition, logged)
+    return (
+        db.query(
+            models.Issue.id,
+            models.Issue.query,
+            func.coalesce(models.Issue.corrected_product_code, models.Issue.product_code),
+        )
+        .filter(condition)
+        .order_by(models.Issue.id)
+        .all()
+    )
+
+# FTS5 index over issues.query / issues.response (migration 4), keyed by issues.id
+ISSUES_FTS = table("issues_fts", column("rowid"))
+# bm25 column weights: a match in the user's query counts for more than one
+# in the generated response
+SEARCH_WEIGHTS = (1.0, 0.5)
+
+def fts_match_expression(text: str):
+    """
+    FTS5 MATCH expression for free text: every word has to occur (in either
+    column), and a trailing * makes a word a prefix. Words are quoted so
+    FTS5 operators and punctuation in user input can't cause syntax errors.
+    Raises ValueError if text has no words.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    if not terms:
+        raise ValueError("Search text has no words")
+    return ' '.join(terms)
+
+def search_issues(db: Session, text: str, user_id: int = None, product_code: int = None, limit: int = 20, offset: int = 0):
+    """
+    Issues whose query or response match text, best match (bm25) first,
+    optionally only one user's and / or one product's. Returns (rows of
+    ISSUE_LIST_COLUMNS plus rank and snippet, next_offset); next_offset is
+    None on the last page.
+    """
+    fts = literal_column("issues_fts")
+    query = (
+        db.query(
+            *ISSUE_LIST_COLUMNS,
+            func.bm25(fts, *SEARCH_WEIGHTS).label("rank"),
+            # Matched words in [brackets], from whichever column matched best
+            func.snippet(fts, -1, '[', ']', '...', 16).label("snippet"),
+        )
+        .join(ISSUES_FTS, ISSUES_FTS.c.rowid == models.Issue.id)
+        .filter(fts.match(fts_match_expression(text)))
+    )
+    if user_id is not None:
+        query = query.filter(models.Issue.user_id == user_id)
+    if product_code is not None:
+        query = query.filter(models.Issue.product_code == product_code)
+    rows = (
+        query.order_by(literal_column("rank"), models.Issue.id.desc())
+        .offset(offset)
+        .limit(limit + 1)
+        .all()
+    )
+    next_offset = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_offset = offset + limit
+    return rows, next_offset
@@ -1,9 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .utils import metrics
 from .utils.logger import setup_logger
 import os
-from datetime import datetime
 
 logger = setup_logger(__name__)
 
@@ -16,20 +18,98 @@ DB_PATH = os.path.join(DB_DIRECTORY, DB_FILENAME)
 MODEL_DIRECTORY = os.getenv('MODEL_DIRECTORY', './data4c/results')
 MODEL_FILENAME = 'model_distill_bert.pth'
 MODEL_PATH = os.path.join(MODEL_DIRECTORY, MODEL_FILENAME)
+# Self-contained model (safetensors weights + config + tokenizer) from before
+# versioning; migrated into MODEL_VERSIONS_PATH on first load
+MODEL_ARTIFACT_DIRNAME = 'model_distill_bert'
+MODEL_ARTIFACT_PATH = os.path.join(MODEL_DIRECTORY, MODEL_ARTIFACT_DIRNAME)
+# One artifact directory per trained version, and a pointer to the live one
+MODEL_VERSIONS_PATH = os.path.join(MODEL_DIRECTORY, 'versions')
+MODEL_CURRENT_PATH = os.path.join(MODEL_DIRECTORY, 'CURRENT')
 
 TRAINING_DATA_DIRECTORY = os.getenv('TRAINING_DATA_DIRECTORY', './data4c')
 TRAINING_DATA_FILENAME = 'customer_queries.csv'
 TRAINING_DATA_PATH = os.path.join(TRAINING_DATA_DIRECTORY, TRAINING_DATA_FILENAME)
+# Pre-tokenized training data, keyed by CSV content and tokenizer
+TOKENIZED_CACHE_DIRECTORY = os.getenv('TOKENIZED_CACHE_DIRECTORY', os.path.join(TRAINING_DATA_DIRECTORY, 'cache', 'tokenized'))
 
 # Ensure data directory exists
 os.makedirs(DB_DIRECTORY, exist_ok=True)
 
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# SQLite performance profile applied to every new connection:
+#   wal     - WAL journal, synchronous=NORMAL, mmap and a larger page cache
+#   default - SQLite's own settings (rollback journal, synchronous=FULL)
+DB_PROFILE = os.getenv('DB_PROFILE', 'wal')
+DB_PROFILES = {
+    'default': {},
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,  # 256MB
+        'cache_size': -65536,  # negative = KiB, i.e. 64MB
+        'busy_timeout': 5000,  # ms
+        'temp_store': 'MEMORY',
+    },
+}
+
+def sqlite_pragmas(profile=DB_PROFILE):
+    """PRAGMAs for a profile, with per-setting overrides such as SQLITE_MMAP_SIZE"""
+    if profile not in DB_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE: {profile} (expected one of {', '.join(DB_PROFILES)})")
+    pragmas = dict(DB_PROFILES[profile])
+    for name in ('journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout', 'temp_store'):
+        override = os.getenv(f'SQLITE_{name.upper()}')
+        if override:
+            pragmas[name] = override
+    return pragmas
+
+def apply_sqlite_pragmas(target_engine, pragmas=None):
+    """Run the profile's PRAGMAs on every connection the engine opens"""
+    pragmas = sqlite_pragmas() if pragmas is None else pragmas
+
+    @event.listens_for(target_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+DB_POOL_CONNECTIONS = metrics.gauge(
+    'db_pool_connections', 'Connections in the SQLAlchemy pool by state', ['engine', 'state']
+)
+
+def register_pool_metrics(target_engine, name):
+    """Report target_engine's pool usage through db_pool_connections at scrape time"""
+    pool = target_engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return  # NullPool / StaticPool keep no statistics
+    DB_POOL_CONNECTIONS.set_function(pool.size, engine=name, state='size')
+    DB_POOL_CONNECTIONS.set_function(pool.checkedout, engine=name, state='checked_out')
+    DB_POOL_CONNECTIONS.set_function(pool.checkedin, engine=name, state='checked_in')
+    # SQLAlchemy counts overflow from -size; report only connections beyond size
+    DB_POOL_CONNECTIONS.set_function(lambda: max(0, pool.overflow()), engine=name, state='overflow')
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+apply_sqlite_pragmas(engine)
+register_pool_metrics(engine, 'sync')
+# expire_on_commit=False: objects stay usable after commit without a re-SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Async engine for the FastAPI routers (aiosqlite runs SQLite calls on its own
+# thread, so a slow commit doesn't block the event loop). Scripts keep using
+# the sync engine above. Pooled explicitly: older SQLAlchemy releases default
+# file-based aiosqlite to NullPool, which opens (and re-runs the PRAGMAs on)
+# a new connection for every session.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=AsyncAdaptedQueuePool)
+apply_sqlite_pragmas(async_engine.sync_engine)
+register_pool_metrics(async_engine.sync_engine, 'async')
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
 
 Base = declarative_base()
 
@@ -40,6 +120,10 @@ def get_session():
     finally:
         db.close()
 
+async def get_async_session():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
     """Initialize database if it doesn't exist"""
     from . import models  # Import models here to avoid circular imports
@@ -94,33 +178,3 @@ def init_db():
     except Exception as e:
         logger.error(f"Error initializing database: {e}", exc_info=True)
         raise
-
-def backup_db():
-    """Create a backup of the database"""
-    if not os.path.exists(DB_PATH):
-        logger.warning("No database to backup")
-        return
-        
-    try:
-        # Create backup directory
-        backup_dir = os.path.join(DB_DIRECTORY, 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Create backup filename with timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = os.path.join(backup_dir, f'db4chatbot_{timestamp}.db')
-        
-        # Copy current database to backup
-        import shutil
-        shutil.copy2(DB_PATH, backup_path)
-        logger.info(f"Database backed up to {backup_path}")
-        
-        # Keep only last 5 backups
-        backups = sorted([f for f in os.listdir(backup_dir) if f.startswith('db4chatbot_')])
-        if len(backups) > 5:
-            for old_backup in backups[:-5]:
-                os.remove(os.path.join(backup_dir, old_backup))
-                logger.debug(f"Removed old backup: {old_backup}")
-                
-    except Exception as e:
-        logger.error(f"Error backing up database: {e}", exc_info=True)
\ No newline at end of file
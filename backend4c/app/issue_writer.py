@@ -0,0 +1,119 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from . import crud, models
+from .database import SessionLocal
+from .utils import metrics
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+WRITER_QUEUE_DEPTH = metrics.gauge('issue_writer_queue_depth', 'Issue inserts waiting for the next group commit')
+GROUP_COMMIT_SIZE = metrics.histogram(
+    'issue_writer_group_size', 'Issues written per group commit', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+
+# Group commit for issue inserts; off by default
+DB_GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')
+GROUP_COMMIT_INTERVAL_MS = float(os.getenv('DB_GROUP_COMMIT_INTERVAL_MS', '5'))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH', '256'))
+
+_STOP = object()
+
+
+class IssueWriter:
+    """
+    Coalesces issue inserts from concurrent requests into one transaction.
+
+    A background thread collects inserts for up to interval_ms (or max_batch
+    rows), writes them with a single commit, and resolves each caller's
+    future with the id of its own row. One fsync is shared by the whole
+    group instead of one per request.
+    """
+
+    def __init__(self, session_factory=SessionLocal, interval_ms=GROUP_COMMIT_INTERVAL_MS,
+                 max_batch=GROUP_COMMIT_MAX_BATCH):
+        self.session_factory = session_factory
+        self.interval = max(0.0, float(interval_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="issue-writer", daemon=True)
+        self._thread.start()
+        WRITER_QUEUE_DEPTH.set_function(self._queue.qsize)
+        logger.info(
+            f"Issue group-commit writer started (interval_ms={self.interval * 1000:.1f}, "
+            f"max_batch={self.max_batch})"
+        )
+
+    def stop(self):
+        """Flush everything queued so far, then stop the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        logger.info("Issue group-commit writer stopped")
+
+    def submit(self, user_id, query, product_code, product_name, response):
+        """Queue an issue insert; returns a Future resolving to the new issue id"""
+        future = Future()
+        fields = {
+            "query": query,
+            "user_id": user_id,
+            "product_code": product_code,
+            "product_name": product_name,
+            "response": response,
+            "created_at": models.Issue.get_current_time(),
+        }
+        self._queue.put((fields, future))
+        return future
+
+    async def create_issue(self, **fields):
+        """Awaitable submit() for use from async route handlers"""
+        return await asyncio.wrap_future(self.submit(**fields))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        GROUP_COMMIT_SIZE.observe(len(batch))
+        db = self.session_factory()
+        try:
+            issue_ids = crud.create_issues(db, [fields for fields, _ in batch])
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error writing {len(batch)} issues: {str(e)}", exc_info=True)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        logger.debug(f"Group commit wrote {len(batch)} issues")
+        for (_, future), issue_id in zip(batch, issue_ids):
+            future.set_result(issue_id)
@@ -1,15 +1,29 @@
-import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from .classification import issue_classification
-from .routers import user_router, issue_router
-from .database import Base, engine, init_db, backup_db
+from .classification.backends import configure_threads
+from .classification.batching import ClassificationBatcher
+from .classification.cache import CACHE_SIZE, ResultCache
+from .classification.deployment import MODEL_AUTO_TRAIN, ModelManager
+from .classification.pool import INFERENCE_WORKERS, InferencePool
+from .similarity import IndexBuilder
+from .routers import admin_router, user_router, issue_router
+from .analytics import AnalyticsCompactor
+from .backup import BackupScheduler
+from .database import Base, engine, async_engine, init_db
+from .issue_writer import DB_GROUP_COMMIT, IssueWriter
+from .migrations import run_migrations
+from .utils import metrics
 from .utils.logger import setup_logger
+from .utils.responses import FastResponse, add_compression
 
 logger = setup_logger(__name__)
 
-app = FastAPI()
+CACHE_ENTRIES = metrics.gauge('classifier_cache_entries', 'Entries in the classification result cache')
+
+# orjson-rendered JSON for every endpoint that doesn't pick its own response class
+app = FastAPI(default_response_class=FastResponse)
 
 # Configure CORS first
 app.add_middleware(
@@ -18,6 +32,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Then add SessionMiddleware
@@ -30,34 +45,90 @@ app.add_middleware(
     https_only=False,
 )
 
+# gzip / brotli for large responses (RESPONSE_COMPRESSION)
+add_compression(app)
+
+# Outermost, so request latency includes the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Global classifier variable
 classifier = None
+# Batches concurrent classify requests in front of the classifier
+classification_batcher = None
+# Worker processes serving classify batches when INFERENCE_WORKERS > 0
+inference_pool = None
+# Group-commits issue inserts when DB_GROUP_COMMIT is enabled
+issue_writer = None
+# Background training and hot-swapping of model versions
+model_manager = None
+# Embeds issues missing from the live version's similar-issue index (SIMILAR_ISSUES)
+index_builder = None
+# Online database backups in the background
+backup_scheduler = BackupScheduler()
+# Folds new issues into the analytics rollups in the background
+analytics_compactor = AnalyticsCompactor()
 
 @app.on_event("startup")
 async def startup_event():
-    global classifier
+    global classifier, classification_batcher, inference_pool, issue_writer, model_manager, index_builder
     try:
-        # Create backup of existing database if it exists
-        backup_db()
-        
         # Initialize database if needed
         db_initialized = init_db()
         if db_initialized:
             logger.info("New database initialized")
         else:
             logger.info("Using existing database")
+        run_migrations()
         
-        # Initialize classifier
+        # Thread pools are fixed by the first forward pass, which the warmup runs
+        configure_threads()
+        # Initialize classifier (loads and warms up the current model version, if any)
         classifier = issue_classification.IssueClassifier()
         
-        # Check if model needs training
-        model_path = './data4c/results/model_distill_bert.pth'
-        if not os.path.exists(model_path):
-            logger.info("Training new model...")
-            success = classifier.train()
-            if not success:
-                logger.error("Failed to train model")
-                raise Exception("Model training failed")
+        cache = ResultCache() if CACHE_SIZE > 0 else None
+        if cache is not None:
+            CACHE_ENTRIES.set_function(lambda: len(cache))
+        if INFERENCE_WORKERS > 0:
+            inference_pool = InferencePool(classifier)
+            inference_pool.start()
+            classification_batcher = ClassificationBatcher(
+                inference_pool, cache=cache, max_concurrency=inference_pool.workers
+            )
+        else:
+            classification_batcher = ClassificationBatcher(classifier, cache=cache)
+        classification_batcher.start()
+        
+        # Catches the live version's index up now, after every model swap
+        # and periodically, without holding up startup
+        if classifier.embeddings_enabled:
+            index_builder = IndexBuilder(classifier)
+            index_builder.start()
+        
+        # Swaps in new model versions as they are published; training runs
+        # in its own process so startup never waits for it
+        model_manager = ModelManager(
+            classifier, pool=inference_pool, on_swap=index_builder.request if index_builder else None
+        )
+        model_manager.start()
+        if not classifier.is_trained:
+            if MODEL_AUTO_TRAIN:
+                logger.info("No trained model yet; training one in the background")
+                model_manager.start_training()
+            else:
+                logger.warning("No trained model yet; classification is unavailable until one is published")
+        
+        # Started after the inference pool has forked its workers
+        if DB_GROUP_COMMIT:
+            issue_writer = IssueWriter()
+            issue_writer.start()
+        
+        # Back up the database now (and every DB_BACKUP_INTERVAL_MINUTES)
+        # without holding up startup
+        backup_scheduler.start()
+        
+        # Catches up on issues logged since the last run, then every
+        # ANALYTICS_COMPACT_INTERVAL_SECONDS
+        analytics_compactor.start()
         
         logger.info("Startup completed successfully")
     except Exception as e:
@@ -67,8 +138,22 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     try:
+        if model_manager:
+            model_manager.stop()
+        if index_builder:
+            index_builder.stop()
+        if classification_batcher:
+            await classification_batcher.stop()
+        if inference_pool:
+            inference_pool.shutdown()
+        if issue_writer:
+            issue_writer.stop()
+        analytics_compactor.stop()
+        await async_engine.dispose()
+        
         # Create final backup when shutting down
-        backup_db()
+        backup_scheduler.stop()
+        backup_scheduler.backup_now()
         logger.info("Shutdown completed successfully")
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}", exc_info=True)
@@ -78,9 +163,42 @@ def root():
     logger.info("Root endpoint accessed")
     return {"message": "Backend is running"}
 
+@app.get("/ready")
+def ready(response: Response):
+    """
+    Readiness, as opposed to the liveness of /: 200 once a warmed-up model
+    version is serving classify requests, 503 until then (e.g. while the
+    first model trains)
+    """
+    runtime = classifier.runtime if classifier is not None else None
+    serving = inference_pool.is_trained if inference_pool is not None else runtime is not None
+    is_ready = bool(
+        serving
+        and runtime is not None
+        and runtime.warmup_seconds is not None
+        and classification_batcher is not None
+        and classification_batcher.running
+    )
+    if not is_ready:
+        response.status_code = 503
+    return {
+        "ready": is_ready,
+        "model_version": runtime.version if runtime is not None else None,
+        "backend": runtime.backend.name if runtime is not None else None,
+        "compile": runtime.backend.compile_mode if runtime is not None else None,
+        "warmup_seconds": runtime.warmup_seconds if runtime is not None else None,
+        "training": model_manager.training["state"] if model_manager is not None else None,
+    }
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text-format metrics for this process"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Include routers
 app.include_router(user_router.router)
 app.include_router(issue_router.router)
+app.include_router(admin_router.router)
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -0,0 +1,108 @@
+from .database import Base, engine
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+
+def add_column(table, column, ddl):
+    """Migration step adding a column unless the table already has it"""
+    def step(conn):
+        columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return step
+
+
+def create_table(table):
+    """Migration step creating a table defined in models.py unless it exists"""
+    def step(conn):
+        from . import models  # noqa: F401  (registers the tables on Base.metadata)
+        Base.metadata.tables[table].create(conn, checkfirst=True)
+    return step
+
+
+# Schema changes for databases created before the change, in order.
+# Each entry is (version, description, statements); the applied version is
+# kept in SQLite's PRAGMA user_version. Statements (SQL strings, or callables
+# taking the connection) must be idempotent because fresh databases already
+# get the current schema from Base.metadata.create_all.
+MIGRATIONS = [
+    (
+        1,
+        "composite index for keyset pagination of issue history",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_issues_user_created_id "
+            "ON issues (user_id, created_at, id)",
+        ],
+    ),
+    (
+        2,
+        "product corrections on issues for incremental retraining",
+        [
+            add_column("issues", "corrected_product_code", "INTEGER"),
+            add_column("issues", "corrected_at", "DATETIME"),
+            "CREATE INDEX IF NOT EXISTS ix_issues_corrected_at "
+            "ON issues (corrected_at) WHERE corrected_at IS NOT NULL",
+        ],
+    ),
+    (
+        3,
+        "analytics rollup tables (filled from existing issues by the compactor)",
+        [
+            create_table("analytics_product_hourly"),
+            create_table("analytics_product_daily"),
+            create_table("analytics_user_product"),
+            create_table("analytics_state"),
+        ],
+    ),
+    (
+        4,
+        "FTS5 full-text index over issue queries and responses",
+        [
+            # External-content table: the text stays in issues, the index
+            # maps terms to issues.id (see crud.search_issues)
+            "CREATE VIRTUAL TABLE IF NOT EXISTS issues_fts USING fts5("
+            "query, response, content='issues', content_rowid='id', "
+            "tokenize='porter unicode61 remove_diacritics 2')",
+            "CREATE TRIGGER IF NOT EXISTS issues_fts_insert AFTER INSERT ON issues BEGIN "
+            "INSERT INTO issues_fts (rowid, query, response) VALUES (new.id, new.query, new.response); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS issues_fts_delete AFTER DELETE ON issues BEGIN "
+            "INSERT INTO issues_fts (issues_fts, rowid, query, response) "
+            "VALUES ('delete', old.id, old.query, old.response); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS issues_fts_update AFTER UPDATE OF query, response ON issues BEGIN "
+            "INSERT INTO issues_fts (issues_fts, rowid, query, response) "
+            "VALUES ('delete', old.id, old.query, old.response); "
+            "INSERT INTO issues_fts (rowid, query, response) VALUES (new.id, new.query, new.response); "
+            "END",
+            # Backfill: re-index every existing issue
+            "INSERT INTO issues_fts (issues_fts) VALUES ('rebuild')",
+        ],
+    ),
+]
+
+
+def run_migrations(target_engine=engine):
+    """Apply every migration newer than the database's user_version"""
+    with target_engine.begin() as conn:
+        current = conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    applied = 0
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        with target_engine.begin() as conn:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+        applied += 1
+
+    if applied:
+        logger.info(f"Applied {applied} migration(s)")
+    return applied
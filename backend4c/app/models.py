@@ -2,13 +2,14 @@ import uuid
 import sqlalchemy as sa
 from datetime import datetime
 from pydantic import BaseModel, EmailStr, Field
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer, Index
 from sqlalchemy.orm import relationship
 from .database import Base
 from passlib.context import CryptContext
 import pytz
 from zoneinfo import ZoneInfo
 import time
+from typing import Optional
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -38,13 +39,61 @@ class Issue(Base):
     product_name = Column(String)
     response = Column(String)
     created_at = Column(DateTime(timezone=True))
+    # Product confirmed by a user or admin when the prediction was wrong;
+    # consumed by incremental retraining
+    corrected_product_code = Column(Integer, nullable=True)
+    corrected_at = Column(DateTime(timezone=True), nullable=True)
     user = relationship("User", back_populates="issues")
 
+    __table_args__ = (
+        # Backs keyset pagination of a user's history (see crud.get_user_issues_page)
+        Index("ix_issues_user_created_id", "user_id", "created_at", "id"),
+        # Only corrected rows are indexed (see crud.get_training_issues)
+        Index(
+            "ix_issues_corrected_at", "corrected_at",
+            sqlite_where=sa.text("corrected_at IS NOT NULL"),
+        ),
+    )
+
     @staticmethod
     def get_current_time():
         """Get current time in local timezone"""
         return datetime.now(local_tz)
 
+# Analytics rollups, maintained from the issues table by analytics.AnalyticsCompactor.
+# Buckets are local-time strings ('YYYY-MM-DD HH:00' / 'YYYY-MM-DD'), as created_at is stored
+class ProductHourlyCount(Base):
+    __tablename__ = "analytics_product_hourly"
+
+    hour = Column(String, primary_key=True)
+    product_code = Column(Integer, primary_key=True)
+    product_name = Column(String)
+    count = Column(Integer, nullable=False, default=0)
+
+class ProductDailyCount(Base):
+    __tablename__ = "analytics_product_daily"
+
+    day = Column(String, primary_key=True)
+    product_code = Column(Integer, primary_key=True)
+    product_name = Column(String)
+    count = Column(Integer, nullable=False, default=0)
+
+class UserProductCount(Base):
+    __tablename__ = "analytics_user_product"
+
+    user_id = Column(Integer, primary_key=True)
+    product_code = Column(Integer, primary_key=True)
+    product_name = Column(String)
+    count = Column(Integer, nullable=False, default=0)
+    last_issue_at = Column(DateTime(timezone=True))
+
+class AnalyticsState(Base):
+    """Compactor bookkeeping, e.g. the last issue id folded into the rollups"""
+    __tablename__ = "analytics_state"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False)
+
 # Pydantic Models for API
 class UserBase(BaseModel):
     email: str
@@ -74,6 +123,18 @@ class IssueInDB(IssueBase):
     product_name: str
     user_id: int
     created_at: datetime
+    corrected_product_code: Optional[int] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class IssueCorrection(BaseModel):
+    product_code: int
+class IssueSearchResult(IssueInDB):
+    # bm25 score; lower is a better match
+    rank: float
+    snippet: str
+
+class IssueSearchPage(BaseModel):
+    results: list[IssueSearchResult]
+    next_offset: Optional[int] = None
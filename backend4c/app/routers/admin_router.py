@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import Optional
+from .. import analytics
+from ..auth import require_superuser
+from ..classification import registry
+from ..database import get_session
+from ..utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+def get_model_manager():
+    from ..main import model_manager
+    if not model_manager:
+        raise HTTPException(status_code=503, detail="Model manager not initialized")
+    return model_manager
+
+class TrainRequest(BaseModel):
+    train_file: Optional[str] = None
+    # Continue from the current version on newly logged / corrected issues
+    incremental: bool = False
+
+@router.get("/model")
+def model_status(admin=Depends(require_superuser), manager=Depends(get_model_manager)):
+    """Live and current model versions, published versions and training state"""
+    return manager.status()
+
+@router.post("/model/train", status_code=202)
+def train_model(
+    request: Optional[TrainRequest] = None,
+    admin=Depends(require_superuser),
+    manager=Depends(get_model_manager)
+):
+    """Train a new version in the background; it goes live when training finishes"""
+    kwargs = {"incremental": bool(request and request.incremental)}
+    if request and request.train_file:
+        kwargs["train_file"] = request.train_file
+    if not manager.start_training(**kwargs):
+        raise HTTPException(status_code=409, detail="Training is already running")
+    logger.info(f"Training started by {admin.email}")
+    return manager.status()
+
+@router.post("/model/reload")
+def reload_model(admin=Depends(require_superuser), manager=Depends(get_model_manager)):
+    """Swap to the version CURRENT points at now instead of at the next check"""
+    swapped = manager.reload()
+    return {"swapped": swapped, **manager.status()}
+
+@router.post("/model/versions/{version}/activate")
+def activate_model_version(
+    version: str,
+    admin=Depends(require_superuser),
+    manager=Depends(get_model_manager)
+):
+    """Make a published version current, e.g. to roll back"""
+    if version not in registry.list_versions():
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {version}")
+    manager.activate(version)
+    logger.info(f"Model version {version} activated by {admin.email}")
+    return manager.status()
+
+# Default report windows when no since is given
+DEFAULT_ANALYTICS_WINDOW = {"hour": timedelta(hours=24), "day": timedelta(days=7)}
+
+@router.get("/analytics/products")
+def product_analytics(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    product_code: Optional[int] = None,
+    admin=Depends(require_superuser),
+    db: Session = Depends(get_session)
+):
+    """
+    Issue counts per product per hour or day, and totals over the window
+    (default: the last 24 hours / 7 days), read from the rollups
+    """
+    if since is None:
+        since = datetime.now() - DEFAULT_ANALYTICS_WINDOW[granularity]
+    report = analytics.product_counts(db, granularity, since, until, product_code)
+    return {"granularity": granularity, "since": since, "until": until, **report, **analytics.status(db)}
+
+@router.get("/analytics/users")
+def user_analytics(
+    limit: int = Query(50, ge=1, le=500),
+    product_code: Optional[int] = None,
+    admin=Depends(require_superuser),
+    db: Session = Depends(get_session)
+):
+    """Users with the most issues, optionally for one product"""
+    return {"users": analytics.top_users(db, limit, product_code), **analytics.status(db)}
+
+@router.get("/analytics/users/{user_id}")
+def user_product_analytics(user_id: int, admin=Depends(require_superuser), db: Session = Depends(get_session)):
+    """One user's issue counts per product"""
+    return {"user_id": user_id, "products": analytics.user_product_counts(db, user_id), **analytics.status(db)}
+
+@router.post("/analytics/compact")
+def compact_analytics(admin=Depends(require_superuser), db: Session = Depends(get_session)):
+    """Fold in issues logged since the last compaction pass now"""
+    from ..main import analytics_compactor
+    advanced = analytics_compactor.compact_now()
+    if advanced is None:
+        raise HTTPException(status_code=500, detail="Compaction failed; see the server log")
+    return {"advanced": advanced, **analytics.status(db)}
@@ -1,14 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response
+import asyncio
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from pydantic import BaseModel
-from .. import crud
-from ..database import get_session
-from ..models import IssueCreate, IssueInDB
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from .. import async_crud, auth, crud, similarity
+from ..classification import cascade
+from ..classification.issue_classification import ModelNotReadyError
+from ..database import get_async_session, get_session
+from ..models import IssueCorrection, IssueCreate, IssueInDB, IssueSearchPage
+from ..utils import metrics
 from ..utils.logger import setup_logger
+from ..utils.responses import FastResponse
 
 logger = setup_logger(__name__)
 
+# Where the time of a POST /issues/classify/ goes; the DB write is further
+# split into insert / commit by db_write_seconds
+CLASSIFY_STAGE_SECONDS = metrics.histogram(
+    'classify_request_stage_seconds', 'POST /issues/classify/ time per stage', ['stage']
+)
+
 router = APIRouter(
     prefix="/issues",
     tags=["issues"]
@@ -19,60 +33,109 @@ def get_classifier():
     from ..main import classifier
     return classifier
 
+def index_embeddings(issue_ids, results):
+    """Hand logged issues' embeddings to the index builder thread (no-op with SIMILAR_ISSUES off)"""
+    from ..main import index_builder
+    if index_builder is not None:
+        index_builder.submit(issue_ids, results)
+
 class QueryRequest(BaseModel):
     query: str
 
+# Upper bound on queries per bulk request; larger backfills should use
+# python -m app.classification.batch_classify
+MAX_BULK_QUERIES = 1000
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BULK_QUERIES)
+
+class SimilarIssuesRequest(BaseModel):
+    query: str
+    k: int = Field(5, ge=1, le=50)
+
+def prediction_fields(result):
+    """Confidence and top-k alternatives of a ClassificationResult, for API responses"""
+    return {
+        "confidence": result.confidence,
+        "tier": result.tier,
+        "top_k": [
+            {"product_code": code, "product_name": name, "confidence": confidence}
+            for code, name, confidence in result.top_k
+        ]
+    }
+
 @router.post("/classify/")
 async def classify_query(
     request: QueryRequest,
-    req: Request,
     response: Response,
-    db: Session = Depends(get_session)
+    user: auth.CachedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_session)
 ):
-    logger.info(f"Received classification request: {request.query}")
-    logger.debug(f"Session data: {dict(req.session)}")
-    
-    user_id = req.session.get("user_id")
-    if not user_id:
-        logger.warning("Unauthorized access attempt - no user_id in session")
-        raise HTTPException(
-            status_code=401,
-            detail="Please log in to use the chatbot"
-        )
+    logger.debug(f"Received classification request: {request.query}")
+    # Resolved from the session cookie and the user cache, normally without a query
+    user_id = user.id
     
     logger.debug(f"Processing request for user_id: {user_id}")
     
     try:
-        from ..main import classifier
-        if not classifier:
+        from ..main import classification_batcher
+        if not classification_batcher:
             logger.error("Classifier not initialized")
             raise HTTPException(status_code=500, detail="Classifier not initialized")
+        if not classification_batcher.classifier.is_trained:
+            raise ModelNotReadyError("No trained model is loaded yet")
         
-        # Classify the query
-        product_code, product_name = classifier.classify(request.query)
-        logger.info(f"Classification result: {product_name} (code: {product_code})")
+        # Classify the query (batched with concurrent requests, run off the event loop).
+        # Includes the queue wait; tokenize / forward / postprocess are broken
+        # down per batch in classifier_stage_seconds
+        with CLASSIFY_STAGE_SECONDS.time(stage="classify"):
+            result = await classification_batcher.classify(request.query)
+        product_code, product_name = result.product_code, result.product_name
+        logger.debug(f"Classification result: {product_name} (code: {product_code}, confidence: {result.confidence:.3f})")
         
-        # Create issue object
-        issue = IssueCreate(query=request.query)
+        response_text = f"This appears to be a {product_name} related issue"
         
-        # Save to database
-        db_issue = crud.create_user_issue(
-            db=db,
-            issue=issue,
-            user_id=user_id,
-            product_code=product_code,
-            product_name=product_name,
-            response=f"This appears to be a {product_name} related issue"
-        )
-        logger.debug(f"Created issue record: {db_issue.id}")
+        from ..main import issue_writer
+        persist_start = time.perf_counter()
+        if issue_writer:
+            # Group-committed with concurrent requests
+            issue_id = await issue_writer.create_issue(
+                user_id=user_id,
+                query=request.query,
+                product_code=product_code,
+                product_name=product_name,
+                response=response_text
+            )
+        else:
+            # Create issue object
+            issue = IssueCreate(query=request.query)
+            
+            # Save to database
+            db_issue = await async_crud.create_user_issue(
+                db=db,
+                issue=issue,
+                user_id=user_id,
+                product_code=product_code,
+                product_name=product_name,
+                response=response_text
+            )
+            issue_id = db_issue.id
+        index_embeddings([issue_id], [result])
+        CLASSIFY_STAGE_SECONDS.observe(time.perf_counter() - persist_start, stage="persist")
+        logger.debug(f"Created issue record: {issue_id}")
 
         return {
             "query": request.query,
             "product_code": product_code,
             "product_name": product_name,
-            "response": f"This appears to be a {product_name} related issue",
-            "issue_id": db_issue.id
+            **prediction_fields(result),
+            "response": response_text,
+            "issue_id": issue_id
         }
+    except HTTPException:
+        raise
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail="The classifier is still being trained; try again shortly")
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -80,11 +143,123 @@ async def classify_query(
             detail=str(e)
         )
 
+@router.post("/classify/batch")
+async def classify_queries(
+    request: BatchQueryRequest,
+    user: auth.CachedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    user_id = user.id
+    logger.info(f"Received bulk classification request: {len(request.queries)} queries")
+    
+    try:
+        from ..main import classification_batcher
+        if not classification_batcher:
+            logger.error("Classifier not initialized")
+            raise HTTPException(status_code=500, detail="Classifier not initialized")
+        if not classification_batcher.classifier.is_trained:
+            raise ModelNotReadyError("No trained model is loaded yet")
+        
+        # All queries go through the batcher together and share its batches and cache
+        results = await asyncio.gather(
+            *(classification_batcher.classify(query) for query in request.queries)
+        )
+        
+        issues = [
+            {
+                "query": query,
+                "product_code": result.product_code,
+                "product_name": result.product_name,
+                "response": f"This appears to be a {result.product_name} related issue"
+            }
+            for query, result in zip(request.queries, results)
+        ]
+        
+        # Save every row in one transaction
+        issue_ids = await async_crud.create_user_issues(db, user_id=user_id, issues=issues)
+        index_embeddings(issue_ids, results)
+        
+        return {"results": [
+            {**issue, **prediction_fields(result), "issue_id": issue_id}
+            for issue, result, issue_id in zip(issues, results, issue_ids)
+        ]}
+    except HTTPException:
+        raise
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail="The classifier is still being trained; try again shortly")
+    except Exception as e:
+        logger.error(f"Error processing bulk query: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
+
+@router.post("/similar")
+async def find_similar_issues(
+    request: SimilarIssuesRequest,
+    user: auth.CachedUser = Depends(auth.get_current_user),
+    db: Session = Depends(get_session)
+):
+    """
+    Classify a query without logging it and return the k most similar past
+    issues (cosine similarity of sentence embeddings), best first. The
+    embedding comes from the classification's own forward pass. Regular
+    users get their own issues, superusers everyone's.
+    """
+    from ..main import classification_batcher
+    classifier = get_classifier()
+    if not classification_batcher or classifier is None:
+        raise HTTPException(status_code=500, detail="Classifier not initialized")
+    if not classifier.embeddings_enabled:
+        raise HTTPException(status_code=503, detail="Similar-issue search is disabled (SIMILAR_ISSUES=false)")
+    try:
+        if not classification_batcher.classifier.is_trained:
+            raise ModelNotReadyError("No trained model is loaded yet")
+        result = await classification_batcher.classify(request.query)
+        version, embedding = result.model_version, result.embedding
+        if embedding is None:
+            # Answered by the cascade first tier, so DistilBERT has not run yet
+            version, embeddings = await run_in_threadpool(classifier.embed_batch, [request.query])
+            embedding = embeddings[0]
+    except ModelNotReadyError:
+        raise HTTPException(status_code=503, detail="The classifier is still being trained; try again shortly")
+    
+    matches = await run_in_threadpool(
+        similarity.similar_issues, db, version, embedding, request.k,
+        None if user.is_superuser else user.id
+    )
+    return {
+        "query": request.query,
+        "product_code": result.product_code,
+        "product_name": result.product_name,
+        **prediction_fields(result),
+        "similar": [
+            {**IssueInDB.model_validate(issue).model_dump(), "score": score}
+            for issue, score in matches
+        ]
+    }
+
+@router.get("/classify/cache")
+def classify_cache_stats():
+    """Hit/miss counters of the classification result cache"""
+    from ..main import classification_batcher
+    if not classification_batcher or classification_batcher.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **classification_batcher.cache.stats()}
+
+@router.get("/classify/cascade")
+def classify_cascade_stats():
+    """How many classified queries the cascade first tier answered vs. fell through to DistilBERT"""
+    classifier = get_classifier()
+    if classifier is None or not classifier.cascade_enabled:
+        return {"enabled": False}
+    return {"enabled": True, "threshold": classifier.cascade_threshold, **cascade.STATS.stats()}
+
 @router.post("/", response_model=IssueInDB)
 async def create_issue(
     issue: IssueCreate,
     user_id: int,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_async_session)
 ):
     try:
         # classifier = get_classifier()
@@ -96,7 +271,7 @@ async def create_issue(
         response = f"This appears to be a {product_name} related issue (code: {product_code})"
         
         # Create the issue in the database
-        db_issue = crud.create_user_issue(
+        db_issue = await async_crud.create_user_issue(
             db=db,
             issue=issue,
             user_id=user_id,
@@ -107,7 +282,74 @@ async def create_issue(
         return db_issue
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+@router.put("/{issue_id}/correction", response_model=IssueInDB)
+async def correct_issue(
+    issue_id: int,
+    correction: IssueCorrection,
+    user: auth.CachedUser = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """Record the right product for a misclassified issue (used by incremental retraining)"""
+    classifier = get_classifier()
+    if classifier is None or correction.product_code not in classifier.idx2label:
+        raise HTTPException(status_code=422, detail=f"Unknown product code: {correction.product_code}")
+    
+    issue = await async_crud.get_issue(db, issue_id)
+    if issue is None:
+        raise HTTPException(status_code=404, detail="Issue not found")
+    if issue.user_id != user.id and not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not allowed to correct this issue")
+    
+    issue = await async_crud.correct_issue(db, issue, correction.product_code)
+    logger.info(f"Issue {issue_id} corrected to product {correction.product_code} by user {user.id}")
+    return issue
+
+# Deepest offset a search page may start at; narrow the search instead
+MAX_SEARCH_OFFSET = 10000
+
+@router.get("/search", response_model=IssueSearchPage)
+def search_issues(
+    q: str = Query(..., min_length=1, max_length=500),
+    user_id: Optional[int] = None,
+    product_code: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+    user: auth.CachedUser = Depends(auth.get_current_user),
+    db: Session = Depends(get_session)
+):
+    """
+    Full-text search over issue queries and responses, best match first.
+    Words must all match; word* matches a prefix. Regular users search
+    their own issues, superusers everyone's (or user_id's).
+    """
+    if not user.is_superuser:
+        if user_id is not None and user_id != user.id:
+            raise HTTPException(status_code=403, detail="Not allowed to search another user's issues")
+        user_id = user.id
+    try:
+        rows, next_offset = crud.search_issues(
+            db, q, user_id=user_id, product_code=product_code, limit=limit, offset=offset
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Rows are already in IssueSearchResult's shape; skip per-row validation
+    return FastResponse({"results": [row._asdict() for row in rows], "next_offset": next_offset})
+
 @router.get("/user/{user_id}", response_model=List[IssueInDB])
-def read_user_issues(user_id: int, db: Session = Depends(get_session)):
-    issues = crud.get_user_issues(db, user_id=user_id)
-    return issues
+def read_user_issues(
+    user_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_session)
+):
+    """
+    Newest-first page of a user's issues. When more pages exist the
+    X-Next-Cursor response header holds the cursor for the next request.
+    """
+    try:
+        rows, next_cursor = crud.get_user_issues_page(db, user_id=user_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Rows only hold IssueInDB's columns; serialized as they are, without per-row validation
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastResponse([row._asdict() for row in rows], headers=headers)
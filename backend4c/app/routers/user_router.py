@@ -1,11 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, EmailStr, Field
-from ..database import get_session, SessionLocal
+from typing import List, Optional
+from sqlalchemy.exc import IntegrityError
+from ..database import get_async_session, get_session, SessionLocal
 from ..models import User
-from .. import crud
+from .. import auth, crud
 from ..utils.logger import setup_logger
+from ..utils.responses import FastResponse
 
 logger = setup_logger(__name__)
 
@@ -29,7 +33,8 @@ class UserCreate(BaseModel):
 class UserResponse(BaseModel):
     id: int
     email: str
-    full_name: str
+    # The seeded users have no full name
+    full_name: Optional[str] = None
     is_active: bool
     is_superuser: bool
 
@@ -50,7 +55,7 @@ async def login(
     login_data: LoginRequest,
     request: Request,
     response: Response,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_async_session)
 ):
     # Add CORS headers directly to the response
     response.headers["Access-Control-Allow-Origin"] = "http://localhost:3000"
@@ -58,7 +63,8 @@ async def login(
     response.headers["Access-Control-Allow-Methods"] = "POST, OPTIONS"
     response.headers["Access-Control-Allow-Headers"] = "Content-Type"
     
-    user = crud.authenticate_user(db, login_data.email, login_data.password)
+    # Served from the user cache after the first login
+    user = await auth.authenticate_user(db, login_data.email, login_data.password)
     if not user:
         logger.warning(f"Failed login attempt for email: {login_data.email}")
         raise HTTPException(status_code=401, detail="Incorrect email or password")
@@ -86,25 +92,35 @@ async def login_options(response: Response):
     response.headers["Access-Control-Allow-Headers"] = "Content-Type"
     return {}
 
+@router.get("/me", response_model=UserResponse)
+async def read_current_user(user: auth.CachedUser = Depends(auth.get_current_user)):
+    """The logged-in user; lets the frontend check its session without logging in again"""
+    return user
+
 @router.post("/", response_model=UserResponse)
 def create_user(user: UserCreate, db: Session = Depends(get_session)):
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
     new_user = User(
         email=user.email,
         password=user.password,
-        full_name=user.full_name
+        full_name=user.full_name,
+        is_active=True,
+        is_superuser=False
     )
     
+    # The unique index on email rejects duplicates, no need to look first;
+    # every column is set above, so no refresh either
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Email already registered")
+    # Warm the cache for the login that usually follows
+    auth.USER_CACHE.put(new_user)
     return new_user
 
-@router.get("/")
+@router.get("/", response_model=List[UserResponse])
 def get_users(db: Session = Depends(get_session)):
-    users = db.query(User).all()
-    return users
+    # Only UserResponse's columns are selected, so passwords never leave the DB
+    return FastResponse([row._asdict() for row in crud.get_users(db)])
 
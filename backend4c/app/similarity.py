@@ -0,0 +1,301 @@
+"""
+Similar-past-issue search over classifier embeddings.
+
+With SIMILAR_ISSUES on, every DistilBERT classification also returns the
+query's sentence embedding from the same forward pass. The issue routes
+hand the embeddings of the issues they log to IndexBuilder, whose thread
+appends them to the vector index of the model version that produced them
+(MODEL_VERSIONS_PATH/<version>/index), so indexing a new issue costs no
+extra model call and requests never wait on the index's file lock.
+Embeddings from different versions are not comparable, which is why each
+version has its own index.
+
+Issues logged without an embedding (answered by the cascade first tier,
+created through other paths, logged while the feature was off, or while
+the previous version was still serving) are picked up by IndexBuilder as
+well: it embeds whatever the live version's index is missing at startup,
+right after every model swap and then every SIMILAR_INDEX_INTERVAL_SECONDS. Each pass only reads issue ids above the
+last one it checked. Right after a swap the new version's index fills up
+in the background, so searches see the recent history first. The logged
+issues carry no resolution state, so every indexed issue is searchable.
+
+Read-only commands print their output to stdout; everything else is logged.
+
+Usage:
+    python -m app.similarity build                # index issues missing from the current version's index
+    python -m app.similarity build --nlist 1024   # ... then cluster it for IVF search
+    python -m app.similarity status
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from sqlalchemy.orm import Session
+from . import models
+from .classification import registry
+from .classification.vector_index import VectorIndex
+from .database import SessionLocal
+from .migrations import run_migrations
+from .utils import metrics
+from .utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+SEARCH_SECONDS = metrics.histogram('similar_issues_search_seconds', 'Vector index search time per query')
+INDEXED_ISSUES = metrics.counter('similar_issues_indexed_total', 'Issue embeddings appended to a vector index', ['source'])
+
+# Seconds between IndexBuilder catch-up passes; 0 only catches up at startup and after swaps
+INDEX_INTERVAL_SECONDS = float(os.getenv('SIMILAR_INDEX_INTERVAL_SECONDS', '300'))
+# Issues read and embedded at a time by build_index
+BUILD_BATCH_SIZE = 256
+INDEX_DIRNAME = 'index'
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(version, create=True):
+    """
+    The VectorIndex of a model version, opened once per process; None if
+    the version has no index yet (and create is off) or was pruned
+    """
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is not None and os.path.isdir(index.path):
+            return index
+        version_path = registry.version_path(version)
+        path = os.path.join(version_path, INDEX_DIRNAME)
+        if not os.path.isdir(version_path) or not (create or os.path.isdir(path)):
+            _indexes.pop(version, None)
+            return None
+        index = _indexes[version] = VectorIndex(path)
+        # Only the live version (and the one it replaced) are in use
+        while len(_indexes) > 2:
+            _indexes.pop(next(iter(_indexes)))
+        return index
+
+
+def record(issue_ids, results):
+    """
+    Append the embeddings of classified issues to their model version's
+    index; results without an embedding are skipped. Never raises, so a
+    full disk cannot fail whoever logged the issues.
+    """
+    try:
+        by_version = {}
+        for issue_id, result in zip(issue_ids, results):
+            if result.embedding is not None:
+                by_version.setdefault(result.model_version, []).append((issue_id, result.embedding))
+        for version, rows in by_version.items():
+            index = get_index(version)
+            if index is None:
+                continue
+            index.add([issue_id for issue_id, _ in rows], np.stack([embedding for _, embedding in rows]))
+            INDEXED_ISSUES.inc(len(rows), source='classify')
+    except Exception as e:
+        logger.error(f"Error indexing embeddings of issues {list(issue_ids)}: {e}", exc_info=True)
+
+
+def similar_issues(db: Session, version, embedding, k=5, user_id=None):
+    """
+    The k issues most similar to embedding in version's index, best first,
+    as (issue, score) pairs; only user_id's issues if given
+    """
+    index = get_index(version, create=False)
+    if index is None:
+        return []
+    allowed_ids = None
+    if user_id is not None:
+        allowed_ids = [
+            issue_id for issue_id, in
+            db.query(models.Issue.id).filter(models.Issue.user_id == user_id)
+        ]
+        if not allowed_ids:
+            return []
+    with SEARCH_SECONDS.time():
+        hits = index.search(embedding, k, allowed_ids=allowed_ids)
+    issues = {
+        issue.id: issue
+        for issue in db.query(models.Issue).filter(models.Issue.id.in_([issue_id for issue_id, _ in hits]))
+    }
+    # Issues deleted since they were indexed are skipped
+    return [(issues[issue_id], score) for issue_id, score in hits if issue_id in issues]
+
+
+def build_index(classifier, batch_size=BUILD_BATCH_SIZE, after_id=0, stop=None):
+    """
+    Embed every issue with an id above after_id that is missing from the
+    index of the classifier's live version, and append it. Stops early once
+    the stop event is set. Returns (issues added, last issue id checked).
+    """
+    version = classifier.model_version
+    index = get_index(version)
+    # Sorted once, then probed per batch
+    indexed = np.sort(index.ids())
+    added = 0
+    last_id = after_id
+    db = SessionLocal()
+    try:
+        while stop is None or not stop.is_set():
+            # Ids first: on a caught-up index no query text is read at all
+            ids = np.array([
+                issue_id for issue_id, in
+                db.query(models.Issue.id)
+                .filter(models.Issue.id > last_id)
+                .order_by(models.Issue.id)
+                .limit(batch_size)
+            ], dtype=np.int64)
+            if not len(ids):
+                break
+            positions = np.minimum(np.searchsorted(indexed, ids), max(0, len(indexed) - 1))
+            missing = ids[indexed[positions] != ids] if len(indexed) else ids
+            if len(missing):
+                queries = dict(
+                    db.query(models.Issue.id, models.Issue.query)
+                    .filter(models.Issue.id.in_(missing.tolist()))
+                )
+                missing = np.array([issue_id for issue_id in missing.tolist() if issue_id in queries], dtype=np.int64)
+                embedded_version, embeddings = classifier.embed_batch([str(queries[i]) for i in missing.tolist()])
+                if embedded_version != version:
+                    raise RuntimeError(f"Model version changed from {version} to {embedded_version} while indexing")
+                index.add(missing, embeddings)
+                INDEXED_ISSUES.inc(len(missing), source='build')
+                added += len(missing)
+                if added % (batch_size * 40) < len(missing):
+                    logger.info(f"Indexed {added} issues for model version {version} (up to id {ids[-1]})")
+            last_id = int(ids[-1])
+    finally:
+        db.close()
+    if added:
+        logger.info(f"Index of model version {version} holds {len(index)} vectors ({added} added)")
+    return added, last_id
+
+
+class IndexBuilder:
+    """
+    Owns index writes in the API process, on a background thread: appends
+    the embeddings the issue routes submit() (so a request never waits on
+    the index's file lock, e.g. while the CLI clusters it), and runs
+    build_index for the live model version at start, whenever request() is
+    called (after a model swap) and every interval. Remembers the last
+    issue id checked per version.
+    """
+
+    def __init__(self, classifier, interval_seconds=INDEX_INTERVAL_SECONDS):
+        self.classifier = classifier
+        self.interval = max(0.0, float(interval_seconds))
+        self._checked = {}
+        self._pending = queue.SimpleQueue()
+        self._build_requested = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.request()
+        self._thread = threading.Thread(target=self._run, name="similar-index-builder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, issue_ids, results):
+        """Queue the embeddings of newly logged issues for the builder thread to append; never blocks"""
+        self._pending.put((list(issue_ids), list(results)))
+        self._wake.set()
+
+    def request(self):
+        """Catch up as soon as the current pass (if any) is done"""
+        self._build_requested = True
+        self._wake.set()
+
+    def _drain(self):
+        while True:
+            try:
+                issue_ids, results = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            record(issue_ids, results)
+
+    def build_now(self):
+        """One catch-up pass on the calling thread; returns the issues added"""
+        if not self.classifier.is_trained:
+            return 0
+        version = self.classifier.model_version
+        try:
+            added, last_id = build_index(self.classifier, after_id=self._checked.get(version, 0), stop=self._stop)
+        except Exception as e:
+            # e.g. the version was swapped mid-pass; the swap requests another one
+            logger.error(f"Error indexing issues for model version {version}: {e}", exc_info=True)
+            return 0
+        # Only the live version is caught up
+        self._checked = {version: last_id}
+        return added
+
+    def _run(self):
+        next_build = time.monotonic() + self.interval
+        while not self._stop.is_set():
+            # Submissions wake the thread too, so keep the catch-up schedule separately
+            timeout = max(0.0, next_build - time.monotonic()) if self.interval else None
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self._drain()
+            if self._build_requested or (self.interval and time.monotonic() >= next_build):
+                self._build_requested = False
+                self.build_now()
+                next_build = time.monotonic() + self.interval
+        # Don't drop what was logged right before shutdown
+        self._drain()
+
+
+def status(version):
+    index = get_index(version, create=False) if version else None
+    return {"model_version": version, **(index.stats() if index is not None else {"vectors": 0})}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the similar-issue vector indexes")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="embed and index issues missing from a version's index")
+    build.add_argument('--version', default=None, help="model version (default: the current one)")
+    build.add_argument('--nlist', type=int, default=0,
+                       help="afterwards cluster the index into this many IVF lists (0: exact search)")
+    build.add_argument('--batch-size', type=int, default=BUILD_BATCH_SIZE)
+    status_parser = subparsers.add_parser('status', help="show the size of a version's index")
+    status_parser.add_argument('--version', default=None, help="model version (default: the current one)")
+    args = parser.parse_args(argv)
+
+    version = args.version or registry.current_version()
+    if args.command == 'status':
+        print(json.dumps(status(version)))
+        return 0
+    if version is None:
+        logger.error("No model version to index; train one first")
+        return 1
+
+    from .classification.issue_classification import IssueClassifier
+    run_migrations()
+    classifier = IssueClassifier(load=False, embeddings=True)
+    classifier.load_version(version)
+    build_index(classifier, batch_size=args.batch_size)
+    if args.nlist:
+        get_index(version).train_ivf(args.nlist)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
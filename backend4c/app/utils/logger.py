@@ -1,16 +1,115 @@
+import atexit
 import logging
+import multiprocessing
+import os
+import queue
+import random
 import sys
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Create logs directory if it doesn't exist
 log_dir = Path("data4c/logs")
 log_dir.mkdir(parents=True, exist_ok=True)
 
-# Configure logging
-def setup_logger(name):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+
+def _parse_mapping(value):
+    """Parse "name=value,name=value" into a dict"""
+    mapping = {}
+    for item in value.split(','):
+        if '=' in item:
+            key, val = item.split('=', 1)
+            mapping[key.strip()] = val.strip()
+    return mapping
+
+
+# Default level for every app logger
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Per-subsystem levels, e.g. "classification=WARNING,routers.issue_router=DEBUG"
+LOG_LEVELS = {k: v.upper() for k, v in _parse_mapping(os.getenv('LOG_LEVELS', '')).items()}
+# Fraction of DEBUG records kept per subsystem, e.g. "routers.issue_router=0.01"
+LOG_SAMPLE_RATES = {k: float(v) for k, v in _parse_mapping(os.getenv('LOG_SAMPLE_RATES', '')).items()}
+
+# Package every module logger lives under ("app", or "backend4c.app" when
+# imported from the repository root)
+_BASE = __name__.rsplit('.', 2)[0]
+
+_queue_handler = None
+_listener = None
+_handlers = ()
+# Carries the records of forked children (inference pool workers) to the
+# parent, so only one process ever writes (and rotates) app.log
+_fork_queue = None
+_fork_listener = None
+
+
+def _lookup(mapping, name):
+    """
+    Most specific mapping entry for a logger name. Keys may be full logger
+    names or names relative to the app package ("classification").
+    """
+    relative = name[len(_BASE) + 1:] if name.startswith(_BASE + '.') else name
+    best, best_len = None, -1
+    for key, value in mapping.items():
+        for candidate in (name, relative):
+            if (candidate == key or candidate.startswith(key + '.')) and len(key) > best_len:
+                best, best_len = value, len(key)
+    return best
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a configured fraction of DEBUG records per subsystem"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        rate = _lookup(self.rates, record.name)
+        return rate is None or random.random() < rate
+
+
+def _start_listener():
+    global _listener
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _before_fork():
+    global _fork_queue, _fork_listener
+    if _fork_queue is not None:
+        return
+    _fork_queue = multiprocessing.get_context('fork').Queue()
+    _fork_listener = QueueListener(_fork_queue, *_handlers, respect_handler_level=True)
+    _fork_listener.start()
+
+
+def _after_fork_in_child():
+    global _listener, _fork_listener
+    # The parent's writer threads do not survive fork; send records to them instead
+    _listener = _fork_listener = None
+    _queue_handler.queue = _fork_queue
+
+
+def _stop_listener():
+    global _listener, _fork_listener
+    for listener in (_listener, _fork_listener):
+        if listener is not None:
+            listener.stop()
+    _listener = _fork_listener = None
+
+
+def _configure():
+    """
+    One-time setup: loggers only enqueue records, and a background thread
+    does the formatting and the file / console writes.
+    """
+    global _queue_handler, _handlers
+    if _queue_handler is not None:
+        return
 
     # Create formatters
     file_formatter = logging.Formatter(
@@ -34,8 +133,36 @@ def setup_logger(name):
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
 
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    _handlers = (file_handler, console_handler)
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    _start_listener()
+    atexit.register(_stop_listener)
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+    base = logging.getLogger(_BASE)
+    base.setLevel(LOG_LEVEL)
+    base.addHandler(_queue_handler)
+    base.propagate = False
+
+
+# Configure logging
+def setup_logger(name):
+    """
+    Return the logger for name. Safe to call any number of times: handlers
+    are attached once, to the app package logger, and shared by all modules.
+    """
+    _configure()
+    logger = logging.getLogger(name)
+
+    if name != _BASE and not name.startswith(_BASE + '.'):
+        # e.g. __main__ when a module is run as a script
+        if _queue_handler not in logger.handlers:
+            logger.addHandler(_queue_handler)
+        logger.propagate = False
+        logger.setLevel(_lookup(LOG_LEVELS, name) or LOG_LEVEL)
+        return logger
 
-    return logger 
\ No newline at end of file
+    level = _lookup(LOG_LEVELS, name)
+    logger.setLevel(level or logging.NOTSET)  # NOTSET inherits LOG_LEVEL
+    return logger
@@ -0,0 +1,56 @@
+"""
+Response serialization and compression.
+
+FastResponse is the app's default response class: orjson serializes
+dicts, lists, datetimes and numpy values natively and several times faster
+than the stdlib encoder. List endpoints build plain dicts from projected
+row tuples and return FastResponse directly, which also skips FastAPI's
+response_model validation of every row.
+
+add_compression() compresses large responses (gzip, or brotli when the
+optional brotli-asgi package is installed) for clients that accept it.
+"""
+import os
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse
+from .logger import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+# Response compression: gzip | brotli (needs brotli-asgi, else gzip) | off
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'gzip').lower()
+# Bodies smaller than this many bytes are sent uncompressed
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+
+
+class FastResponse(JSONResponse):
+    """JSONResponse rendered with orjson (falls back to the stdlib encoder without it)"""
+
+    def render(self, content):
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def add_compression(app, mode=RESPONSE_COMPRESSION, minimum_size=RESPONSE_COMPRESSION_MIN_SIZE):
+    """Add the configured compression middleware to app; returns the mode in use"""
+    if mode in ('off', 'none', ''):
+        return 'off'
+    if mode == 'brotli':
+        try:
+            from brotli_asgi import BrotliMiddleware
+        except ImportError:
+            logger.warning("RESPONSE_COMPRESSION=brotli needs the brotli-asgi package; using gzip")
+        else:
+            # Clients that don't accept br still get gzip
+            app.add_middleware(BrotliMiddleware, minimum_size=minimum_size, gzip_fallback=True)
+            return 'brotli'
+    elif mode != 'gzip':
+        raise ValueError(f"Unknown RESPONSE_COMPRESSION: {mode} (expected gzip, brotli or off)")
+    app.add_middleware(GZipMiddleware, minimum_size=minimum_size)
+    return 'gzip'
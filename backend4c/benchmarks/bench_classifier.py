@@ -0,0 +1,93 @@
+"""
+Micro-benchmarks of the classifier: IssueClassifier.classify (batch size 1)
+and classify_batch across query lengths (in tokens) and batch sizes, on the
+current model version.
+
+Usage (from backend4c/):
+    python -m benchmarks.bench_classifier
+    python -m benchmarks.bench_classifier --backend onnx --tokens 16 64 256 --batch-sizes 1 32
+"""
+import argparse
+import random
+import sys
+import time
+from app.classification.issue_classification import MAX_SEQ_LEN, IssueClassifier
+from app.database import TRAINING_DATA_PATH
+from .common import print_cases, summarize, time_calls, write_results
+
+FALLBACK_WORDS = (
+    "printer scanner laptop monitor keyboard mouse projector not working error paper jam "
+    "wifi connect battery charging screen flickering driver install update slow noise"
+).split()
+
+
+def load_words(data_file):
+    try:
+        import pandas as pd
+        queries = pd.read_csv(data_file, usecols=['Query'])['Query'].dropna().astype(str)
+        words = " ".join(queries.tolist()).split()
+        return words or FALLBACK_WORDS
+    except (OSError, ValueError):
+        return FALLBACK_WORDS
+
+
+def make_query(tokenizer, words, tokens, rng):
+    """Random query that tokenizes to (about) tokens tokens, special tokens included"""
+    query_words = []
+    while len(tokenizer(" ".join(query_words))['input_ids']) < tokens:
+        query_words.append(rng.choice(words))
+    return " ".join(query_words)
+
+
+def run(classifier, token_lengths, batch_sizes, iterations, warmup, seed, data_file):
+    rng = random.Random(seed)
+    words = load_words(data_file)
+    cases = []
+    for tokens in token_lengths:
+        for batch_size in batch_sizes:
+            queries = [make_query(classifier.tokenizer, words, tokens, rng) for _ in range(batch_size)]
+            if batch_size == 1:
+                call = lambda: classifier.classify(queries[0])
+                name = f"classify,tokens={tokens}"
+            else:
+                call = lambda: classifier.classify_batch(queries)
+                name = f"classify_batch,batch={batch_size},tokens={tokens}"
+            latencies = time_calls(call, iterations, warmup=warmup)
+            cases.append(summarize(
+                name,
+                latencies,
+                items=batch_size * len(latencies),
+                params={"tokens": tokens, "batch_size": batch_size, "backend": classifier.backend_name},
+            ))
+            print(f"  {name}: p50 {cases[-1]['p50_ms']:.2f} ms", file=sys.stderr)
+    return cases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark IssueClassifier.classify / classify_batch")
+    parser.add_argument('--backend', default=None, help="eager | int8 | onnx (default: CLASSIFIER_BACKEND)")
+    parser.add_argument('--tokens', type=int, nargs='+', default=[8, 32, 128, MAX_SEQ_LEN])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=50, help="timed calls per case")
+    parser.add_argument('--warmup', type=int, default=5, help="untimed calls per case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', default=TRAINING_DATA_PATH, help="CSV whose words make up the queries")
+    parser.add_argument('--output', default=None, help="result JSON (default: benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    classifier = IssueClassifier(backend=args.backend)
+    if not classifier.is_trained:
+        print("No trained model version; train one first (python -m app.classification.train)", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    cases = run(classifier, args.tokens, args.batch_sizes, args.iterations, args.warmup, args.seed, args.data)
+    config = {**vars(args), "backend": classifier.backend_name, "model_version": classifier.model_version,
+              "duration_s": round(time.perf_counter() - start, 2)}
+    print_cases(cases)
+    print(f"Results written to {write_results('classifier', config, cases, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""
+DB benchmarks of the issue CRUD paths at realistic table sizes.
+
+For each table size a scratch SQLite database (same PRAGMA profile as the
+app) is seeded with that many issues spread over --users users, then
+crud.create_user_issue, crud.get_user_issues, get_user_issues_page
+(first and a deep page) and search_issues are timed for one user holding --user-issues of
+them. The app's own database is never touched.
+
+Usage (from backend4c/):
+    python -m benchmarks.bench_db
+    python -m benchmarks.bench_db --table-sizes 10000 1000000 --profile default
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud, models
+from app.database import DB_PROFILE, Base, apply_sqlite_pragmas, sqlite_pragmas
+from app.migrations import run_migrations
+from .common import print_cases, summarize, time_calls, write_results
+
+SEED_CHUNK = 10000
+
+
+def seed(engine, table_size, users, user_issues, rng):
+    """Insert users and table_size issues; user 1 gets user_issues of them"""
+    now = datetime.now()
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [
+            {"id": user_id, "email": f"bench{user_id}@example.com", "password": "bench",
+             "full_name": f"Bench {user_id}", "is_active": True, "is_superuser": False}
+            for user_id in range(1, users + 1)
+        ])
+    owners = [1] * min(user_issues, table_size) + [
+        rng.randint(2, users) if users > 1 else 1 for _ in range(max(0, table_size - user_issues))
+    ]
+    rng.shuffle(owners)
+    for start in range(0, table_size, SEED_CHUNK):
+        rows = [
+            {
+                "query": f"benchmark query {i} about the printer not working",
+                "user_id": owners[i],
+                "product_code": i % 20,
+                "product_name": "Printer",
+                "response": "This appears to be a Printer related issue",
+                "created_at": now - timedelta(seconds=table_size - i),
+            }
+            for i in range(start, min(start + SEED_CHUNK, table_size))
+        ]
+        with engine.begin() as conn:
+            conn.execute(models.Issue.__table__.insert(), rows)
+
+
+def run_size(table_size, args, rng):
+    directory = tempfile.mkdtemp(prefix='bench_db_')
+    try:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        apply_sqlite_pragmas(engine, sqlite_pragmas(args.profile))
+        Base.metadata.create_all(bind=engine)
+        # Also creates the full-text index and its triggers, so inserts cost what they do in the app
+        run_migrations(engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+        start = time.perf_counter()
+        seed(engine, table_size, args.users, args.user_issues, rng)
+        print(f"  seeded {table_size} issues in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        params = {"table_size": table_size, "user_issues": args.user_issues, "profile": args.profile}
+        cases = []
+        db = Session()
+        try:
+            def create():
+                crud.create_user_issue(
+                    db, models.IssueCreate(query="my printer is not working"), user_id=1,
+                    product_code=0, product_name="Printer",
+                    response="This appears to be a Printer related issue",
+                )
+            cases.append(summarize(f"create_user_issue,rows={table_size}",
+                                   time_calls(create, args.iterations, args.warmup), params=params))
+
+            def read_all():
+                crud.get_user_issues(db, 1)
+                db.expunge_all()
+            cases.append(summarize(f"get_user_issues,rows={table_size}",
+                                   time_calls(read_all, args.iterations, args.warmup), params=params))
+
+            def first_page():
+                crud.get_user_issues_page(db, 1, limit=args.page_size)
+                db.expunge_all()
+            cases.append(summarize(f"get_user_issues_page,first,rows={table_size}",
+                                   time_calls(first_page, args.iterations, args.warmup),
+                                   params={**params, "page_size": args.page_size}))
+
+            # Cursor that points about halfway into the user's history
+            issues, cursor = crud.get_user_issues_page(db, 1, limit=max(1, args.user_issues // 2))
+            db.expunge_all()
+
+            def deep_page():
+                crud.get_user_issues_page(db, 1, limit=args.page_size, cursor=cursor)
+                db.expunge_all()
+            cases.append(summarize(f"get_user_issues_page,deep,rows={table_size}",
+                                   time_calls(deep_page, args.iterations, args.warmup),
+                                   params={**params, "page_size": args.page_size}))
+
+            def search():
+                crud.search_issues(db, "printer working", user_id=1, limit=args.page_size)
+                db.expunge_all()
+            cases.append(summarize(f"search_issues,rows={table_size}",
+                                   time_calls(search, args.iterations, args.warmup),
+                                   params={**params, "page_size": args.page_size}))
+        finally:
+            db.close()
+            engine.dispose()
+        return cases
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark issue CRUD at several table sizes")
+    parser.add_argument('--table-sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--users', type=int, default=1000, help="users the issues are spread over")
+    parser.add_argument('--user-issues', type=int, default=500, help="issues owned by the benchmarked user")
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--profile', default=DB_PROFILE, help="SQLite PRAGMA profile (wal | default)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="result JSON (default: benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    cases = []
+    for table_size in args.table_sizes:
+        cases.extend(run_size(table_size, args, rng))
+    print_cases(cases)
+    print(f"Results written to {write_results('db', vars(args), cases, args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
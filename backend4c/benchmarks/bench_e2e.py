@@ -0,0 +1,164 @@
+"""
+End-to-end load test of POST /issues/classify/.
+
+Runs the FastAPI app in-process behind an ASGI transport (no server or
+network), with the real startup/shutdown hooks, middleware, batcher,
+inference pool and database writes. A benchmark user is created and
+logged in through /users/login, then --concurrency clients send requests
+back to back for --duration seconds (or --requests in total).
+
+The database is a scratch copy in a temporary directory unless --keep-db
+is given; the model is the current version from MODEL_DIRECTORY, so train
+one first. Server-side settings (INFERENCE_WORKERS, CLASSIFY_MAX_BATCH_SIZE,
+CLASSIFY_CACHE_SIZE, DB_GROUP_COMMIT, ...) are read from the environment as usual.
+
+Usage (from backend4c/, needs requirements-bench.txt):
+    python -m benchmarks.bench_e2e --concurrency 32 --duration 30
+    INFERENCE_WORKERS=2 python -m benchmarks.bench_e2e --concurrency 64 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from .common import print_cases, summarize, write_results
+
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'bench-password'
+
+
+async def login(client):
+    response = await client.post('/users/', json={
+        "email": BENCH_EMAIL, "password": BENCH_PASSWORD, "full_name": "Benchmark",
+    })
+    if response.status_code not in (200, 400):  # 400: already registered (--keep-db)
+        raise RuntimeError(f"Creating the benchmark user failed: {response.status_code} {response.text}")
+    response = await client.post('/users/login', json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+    if response.status_code != 200:
+        raise RuntimeError(f"Login failed: {response.status_code} {response.text}")
+
+
+async def run_load(client, queries, concurrency, duration, total_requests, seed):
+    """Closed-loop load: each client sends its next request when the last one returns"""
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration if duration else None
+    remaining = [total_requests] if total_requests else None
+
+    async def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            try:
+                response = await client.post('/issues/classify/', json={"query": rng.choice(queries)})
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def run(args):
+    # Imported here so DB_DIRECTORY / MODEL_AUTO_TRAIN are set first
+    import httpx
+    from app.main import app
+    from app import main
+
+    await app.router.startup()
+    try:
+        if not main.classifier.is_trained:
+            raise RuntimeError("No trained model version; train one first (python -m app.classification.train)")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+            await login(client)
+            queries = load_queries(args.data, args.queries, args.seed)
+
+            # Untimed warm-up so lazy initialisation doesn't land in the percentiles
+            if args.warmup:
+                await run_load(client, queries, args.concurrency, None, args.warmup, args.seed)
+
+            latencies, statuses, elapsed = await run_load(
+                client, queries, args.concurrency, args.duration, args.requests, args.seed
+            )
+        errors = sum(count for status, count in statuses.items() if status != 200)
+        case = summarize(
+            f"classify,concurrency={args.concurrency}", latencies, elapsed=elapsed, errors=errors,
+            params={"concurrency": args.concurrency, "statuses": {str(k): v for k, v in statuses.items()}},
+        )
+        return case, main.classifier.model_version
+    finally:
+        await app.router.shutdown()
+
+
+def load_queries(data_file, count, seed):
+    """A sample of real queries from the training CSV"""
+    import pandas as pd
+    queries = pd.read_csv(data_file, usecols=['Query'])['Query'].dropna().astype(str).tolist()
+    if not queries:
+        raise RuntimeError(f"No queries in {data_file}")
+    rng = random.Random(seed)
+    return rng.sample(queries, min(count, len(queries)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test POST /issues/classify/ in-process")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds to run (ignored with --requests)")
+    parser.add_argument('--requests', type=int, default=None, help="total requests instead of a duration")
+    parser.add_argument('--warmup', type=int, default=50, help="untimed requests before the run")
+    parser.add_argument('--queries', type=int, default=1000, help="distinct queries sampled from --data")
+    parser.add_argument('--data', default=None, help="CSV to sample queries from (default: TRAINING_DATA_PATH)")
+    parser.add_argument('--keep-db', action='store_true', help="use the configured database instead of a scratch one")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="result JSON (default: benchmarks/results/)")
+    args = parser.parse_args(argv)
+    if args.requests:
+        args.duration = None
+
+    scratch = None
+    if not args.keep_db:
+        scratch = tempfile.TemporaryDirectory(prefix='bench_e2e_')
+        os.environ['DB_DIRECTORY'] = scratch.name
+        os.environ['DB_BACKUP_INTERVAL_MINUTES'] = '0'
+    # Never start a training run from the benchmark
+    os.environ['MODEL_AUTO_TRAIN'] = 'false'
+    if args.data is None:
+        from app.database import TRAINING_DATA_PATH
+        args.data = TRAINING_DATA_PATH
+
+    try:
+        case, model_version = asyncio.run(run(args))
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
+
+    config = {**vars(args), "model_version": model_version}
+    for name in ('INFERENCE_WORKERS', 'CLASSIFY_MAX_BATCH_SIZE', 'CLASSIFY_MAX_WAIT_MS', 'CLASSIFY_CACHE_SIZE',
+                 'DB_GROUP_COMMIT', 'DB_PROFILE', 'CLASSIFIER_BACKEND'):
+        if name in os.environ:
+            config[name] = os.environ[name]
+    print_cases([case])
+    print(f"Status counts: {case['params']['statuses']}")
+    print(f"Results written to {write_results('e2e', config, [case], args.output)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
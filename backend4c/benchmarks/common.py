@@ -0,0 +1,121 @@
+"""
+Shared helpers for the benchmark scripts: latency statistics and the JSON
+result format.
+
+Every script writes one JSON document:
+
+    {
+      "benchmark": "classifier",
+      "started_at": "...", "git_commit": "...", "environment": {...},
+      "config": {...command line...},
+      "cases": [
+        {"name": "batch=8,tokens=32", "params": {...}, "count": 400,
+         "p50_ms": ..., "p95_ms": ..., "p99_ms": ..., "mean_ms": ..., "max_ms": ...,
+         "throughput_per_s": ..., "errors": 0},
+        ...
+      ]
+    }
+
+Cases are matched by name when two runs are compared (benchmarks.compare).
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def summarize(name, latencies, elapsed=None, items=None, params=None, errors=0):
+    """
+    One result case from per-operation latencies (seconds). throughput is
+    items (default: one per latency) per second of elapsed wall time
+    (default: the sum of the latencies, i.e. sequential execution).
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    elapsed = float(latencies.sum()) if elapsed is None else float(elapsed)
+    items = len(latencies) if items is None else items
+    case = {"name": name, "params": params or {}, "count": int(len(latencies)), "errors": int(errors)}
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        case.update({
+            "p50_ms": round(float(p50), 4),
+            "p95_ms": round(float(p95), 4),
+            "p99_ms": round(float(p99), 4),
+            "mean_ms": round(float(latencies.mean() * 1000), 4),
+            "max_ms": round(float(latencies.max() * 1000), 4),
+        })
+    case["throughput_per_s"] = round(items / elapsed, 2) if elapsed > 0 else None
+    return case
+
+
+def time_calls(function, iterations, warmup=0):
+    """Call function() warmup + iterations times; returns the timed latencies"""
+    for _ in range(warmup):
+        function()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    for module in ('torch', 'transformers', 'sqlalchemy', 'fastapi'):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return info
+
+
+def write_results(benchmark, config, cases, output=None):
+    """Write the result document and return its path"""
+    started_at = datetime.now()
+    document = {
+        "benchmark": benchmark,
+        "started_at": started_at.isoformat(timespec='seconds'),
+        "git_commit": _git_commit(),
+        "environment": environment(),
+        "config": config,
+        "cases": cases,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULTS_DIRECTORY, f"{benchmark}-{started_at.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    return output
+
+
+def print_cases(cases, stream=sys.stdout):
+    header = f"{'case':<40} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per s':>10}"
+    print(header, file=stream)
+    print('-' * len(header), file=stream)
+    for case in cases:
+        print(
+            f"{case['name']:<40} {case['count']:>7} {case.get('p50_ms', float('nan')):>10.3f} "
+            f"{case.get('p95_ms', float('nan')):>10.3f} {case.get('p99_ms', float('nan')):>10.3f} "
+            f"{case['throughput_per_s'] or 0:>10.1f}",
+            file=stream,
+        )
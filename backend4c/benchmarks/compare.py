@@ -0,0 +1,75 @@
+"""
+Compare two benchmark result files case by case (matched by name), e.g. a
+run on main against a run on a branch.
+
+Usage (from backend4c/):
+    python -m benchmarks.compare benchmarks/results/classifier-A.json benchmarks/results/classifier-B.json
+    python -m benchmarks.compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_per_s')
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(base, new):
+    if base in (None, 0) or new is None:
+        return None
+    return (new - base) / base * 100
+
+
+def compare(base, new, threshold):
+    """Print per-case changes; returns the number of regressions beyond threshold percent"""
+    base_cases = {case['name']: case for case in base['cases']}
+    new_cases = {case['name']: case for case in new['cases']}
+    regressions = 0
+    print(f"{'case':<40} {'metric':<17} {'base':>10} {'new':>10} {'change':>9}")
+    for name, new_case in new_cases.items():
+        base_case = base_cases.get(name)
+        if base_case is None:
+            print(f"{name:<40} (new case)")
+            continue
+        for metric in METRICS:
+            delta = change(base_case.get(metric), new_case.get(metric))
+            if delta is None:
+                continue
+            # Higher latency or lower throughput is worse
+            worse = delta < 0 if metric == 'throughput_per_s' else delta > 0
+            flag = ''
+            if worse and abs(delta) > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"{name:<40} {metric:<17} {base_case[metric]:>10.3f} {new_case[metric]:>10.3f} "
+                  f"{delta:>+8.1f}%{flag}")
+    for name in base_cases.keys() - new_cases.keys():
+        print(f"{name:<40} (missing from new run)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=5.0,
+                        help="percent change counted as a regression (exit code 1)")
+    args = parser.parse_args(argv)
+
+    base, new = load(args.base), load(args.new)
+    if base['benchmark'] != new['benchmark']:
+        print(f"Different benchmarks: {base['benchmark']} vs {new['benchmark']}", file=sys.stderr)
+        return 2
+    print(f"base: {base.get('git_commit')} {base['started_at']}")
+    print(f"new:  {new.get('git_commit')} {new['started_at']}")
+    regressions = compare(base, new, args.threshold)
+    print(f"{regressions} regression(s) beyond {args.threshold}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())